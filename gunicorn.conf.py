@@ -0,0 +1,33 @@
+import logging
+import os
+
+# Do not import the app package here: gunicorn loads this file in the master
+# process, and the refresh worker thread started on import would not survive
+# the fork into the worker.
+
+
+def _positive_int(name: str, raw: str, default: int) -> int:
+    try:
+        value = int(raw)
+    except ValueError:
+        value = 0
+    if value < 1:
+        logging.warning("Invalid %s=%r; using %s", name, raw, default)
+        return default
+    return value
+
+
+# Same lookup and 5001 fallback as main._get_port.
+_port = os.getenv("JELLYFIN_NOTIFIER_PORT") or os.getenv("PORT") or "5001"
+bind = f"0.0.0.0:{_positive_int('JELLYFIN_NOTIFIER_PORT', _port, 5001)}"
+
+# The refresh queue and rate limiter live in process memory, so a single
+# worker keeps coalescing intact; threads give the concurrency instead.
+workers = 1
+worker_class = "gthread"
+# Webhooks mostly wait on Jellyfin, so threads are cheap; raise this if a slow
+# server leaves requests queueing.
+threads = _positive_int(
+    "JELLYFIN_NOTIFIER_THREADS", os.getenv("JELLYFIN_NOTIFIER_THREADS") or "8", 8
+)
+keepalive = 30
@@ -1,37 +1,150 @@
+import hashlib
+import json
 import logging
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from operator import itemgetter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 JellyfinResult = Tuple[bool, str, int]
 JellyfinFoldersResult = Tuple[bool, str, int, Optional[List[Dict[str, Any]]]]
 
+_REQUEST_TIMEOUT_SECONDS = 5
+_REFRESH_TIMEOUT_SECONDS = 10
+_MAX_REFRESH_WORKERS = 8
+# Without HTTP/2 every concurrent refresh POST needs its own socket; keep room
+# for a full fan-out plus other calls so connections are not discarded.
+_POOL_MAXSIZE = 2 * _MAX_REFRESH_WORKERS
+_VIRTUAL_FOLDERS_CACHE_SECONDS = 300
+# (sorted folders, /libraries descriptors) built once per fetch.
+_FOLDER_FIELDS = ("Name", "ItemId", "Id", "CollectionType")
+_VirtualFoldersEntry = Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]
+_VIRTUAL_FOLDERS_CACHE: Dict[Tuple[str, bytes], Tuple[float, _VirtualFoldersEntry]] = {}
+_VIRTUAL_FOLDERS_CACHE_LOCK = threading.Lock()
+# Cache keys come from request credentials, so the caches are size-capped.
+_MAX_CACHE_ENTRIES = 32
+# Failed pings are remembered briefly so a dead Jellyfin is not re-probed by
+# every test webhook.
+_PING_FAILURE_CACHE_SECONDS = 10
+_PING_FAILURE_CACHE: Dict[Tuple[str, bytes], Tuple[float, JellyfinResult]] = {}
+_PING_FAILURE_CACHE_LOCK = threading.Lock()
+# Shared by every client and created on first multi-library refresh.
+_REFRESH_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_REFRESH_EXECUTOR_LOCK = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    session.headers["Accept"] = "application/json"
+    # Jellyfin answers 502-504 while it is busy scanning; retrying here keeps
+    # Radarr/Sonarr from re-firing the webhook. A 502-504 means the refresh was
+    # not accepted, so POSTs are retried for those, but never after a read
+    # error: the request may already have been taken, and a hung server would
+    # otherwise cost several full timeouts.
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=False,
+        status=3,
+        backoff_factor=0.3,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["GET", "POST"],
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=4, pool_maxsize=_POOL_MAXSIZE, max_retries=retry
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _get_refresh_executor() -> ThreadPoolExecutor:
+    global _REFRESH_EXECUTOR
+    with _REFRESH_EXECUTOR_LOCK:
+        if _REFRESH_EXECUTOR is None:
+            _REFRESH_EXECUTOR = ThreadPoolExecutor(
+                max_workers=_MAX_REFRESH_WORKERS, thread_name_prefix="jellyfin-refresh"
+            )
+        return _REFRESH_EXECUTOR
+
+
+def _store_capped(cache: Dict[Any, Any], key: Any, value: Any) -> None:
+    # Re-inserting moves the key to the end, so the first key is the oldest.
+    cache.pop(key, None)
+    if len(cache) >= _MAX_CACHE_ENTRIES:
+        del cache[next(iter(cache))]
+    cache[key] = value
+
+
+# Shared across clients so keep-alive connections to Jellyfin survive between
+# webhooks; the API key is sent per request because clients may differ.
+_SESSION = _build_session()
+
 
 @dataclass
 class JellyfinClient:
     url: str
     api_key: str
+    base_url: str = field(init=False, repr=False, compare=False)
+    headers: Dict[str, str] = field(init=False, repr=False, compare=False)
+    cache_key: Tuple[str, bytes] = field(init=False, repr=False, compare=False)
+    _system_info_url: str = field(init=False, repr=False, compare=False)
+    _virtual_folders_url: str = field(init=False, repr=False, compare=False)
+    _library_refresh_url: str = field(init=False, repr=False, compare=False)
+    _item_refresh_url: str = field(init=False, repr=False, compare=False)
 
-    @property
-    def base_url(self) -> str:
-        return self.url.rstrip("/")
-
-    @property
-    def headers(self) -> Dict[str, str]:
-        return {"X-Emby-Token": self.api_key}
+    def __post_init__(self) -> None:
+        self.base_url = self.url.rstrip("/")
+        self.headers = {"X-Emby-Token": self.api_key}
+        self._system_info_url = self.base_url + "/System/Info"
+        self._virtual_folders_url = self.base_url + "/Library/VirtualFolders"
+        self._library_refresh_url = self.base_url + "/Library/Refresh"
+        self._item_refresh_url = self.base_url + "/Items/{}/Refresh"
+        self.cache_key = (
+            self.base_url,
+            hashlib.sha256(self.api_key.encode()).digest(),
+        )
 
     def ping(self) -> JellyfinResult:
+        key = self.cache_key
+        with _PING_FAILURE_CACHE_LOCK:
+            cached = _PING_FAILURE_CACHE.get(key)
+            if cached:
+                if time.monotonic() - cached[0] < _PING_FAILURE_CACHE_SECONDS:
+                    return cached[1]
+                del _PING_FAILURE_CACHE[key]
+
+        result = self._ping()
+        with _PING_FAILURE_CACHE_LOCK:
+            if result[0]:
+                _PING_FAILURE_CACHE.pop(key, None)
+            else:
+                _store_capped(_PING_FAILURE_CACHE, key, (time.monotonic(), result))
+        return result
+
+    def _ping(self) -> JellyfinResult:
         try:
-            requests.get(self.base_url, timeout=5)
-        except requests.RequestException as exc:
+            response = _SESSION.get(
+                self._system_info_url,
+                headers=self.headers,
+                timeout=_REQUEST_TIMEOUT_SECONDS,
+            )
+        except requests.ConnectionError as exc:
             logging.warning("Jellyfin ping failed: host unreachable error=%s", exc)
             return False, f"Failed to reach Jellyfin: {exc}", 502
-
-        ping_url = f"{self.base_url}/System/Info"
-        try:
-            response = requests.get(ping_url, headers=self.headers, timeout=5)
+        except requests.Timeout as exc:
+            logging.warning("Jellyfin /System/Info request timed out error=%s", exc)
+            return False, f"Failed to reach Jellyfin: request timed out ({exc})", 502
         except requests.RequestException as exc:
             logging.warning("Jellyfin /System/Info request failed error=%s", exc)
             return False, f"Failed to reach Jellyfin: {exc}", 502
@@ -51,10 +164,51 @@ class JellyfinClient:
         return False, f"Failed to reach Jellyfin (status {response.status_code})", 502
 
     def fetch_virtual_folders(self) -> JellyfinFoldersResult:
-        url = f"{self.base_url}/Library/VirtualFolders"
+        ok, message, status, entry = self._load_virtual_folders()
+        return ok, message, status, entry[0] if entry else None
+
+    def fetch_libraries(self) -> JellyfinFoldersResult:
+        ok, message, status, entry = self._load_virtual_folders()
+        return ok, message, status, entry[1] if entry else None
+
+    def _load_virtual_folders(
+        self,
+    ) -> Tuple[bool, str, int, Optional[_VirtualFoldersEntry]]:
+        key = self.cache_key
+        with _VIRTUAL_FOLDERS_CACHE_LOCK:
+            cached = _VIRTUAL_FOLDERS_CACHE.get(key)
+        if cached and time.monotonic() - cached[0] < _VIRTUAL_FOLDERS_CACHE_SECONDS:
+            logging.info(
+                "Jellyfin virtual folders count=%s (cached)", len(cached[1][0])
+            )
+            return True, "Jellyfin virtual folders listed", 200, cached[1]
+
+        result = self._request_virtual_folders()
+        ok, _, status, entry = result
+        if ok:
+            with _VIRTUAL_FOLDERS_CACHE_LOCK:
+                _store_capped(_VIRTUAL_FOLDERS_CACHE, key, (time.monotonic(), entry))
+        elif cached and status != 401:
+            # Libraries rarely change; an outdated listing beats failing the
+            # webhook while Jellyfin is briefly unavailable.
+            logging.warning(
+                "Serving stale Jellyfin virtual folders age_seconds=%.0f",
+                time.monotonic() - cached[0],
+            )
+            return True, "Jellyfin virtual folders listed", 200, cached[1]
+        return result
+
+    def _request_virtual_folders(
+        self,
+    ) -> Tuple[bool, str, int, Optional[_VirtualFoldersEntry]]:
         params = {"api_key": self.api_key}
         try:
-            response = requests.get(url, headers=self.headers, params=params, timeout=5)
+            response = _SESSION.get(
+                self._virtual_folders_url,
+                headers=self.headers,
+                params=params,
+                timeout=_REQUEST_TIMEOUT_SECONDS,
+            )
         except requests.RequestException as exc:
             logging.warning("Jellyfin virtual folders request failed error=%s", exc)
             return False, f"Failed to fetch Jellyfin virtual folders: {exc}", 502, None
@@ -79,75 +233,60 @@ class JellyfinClient:
             )
 
         try:
-            folders = response.json()
+            # json.loads detects the UTF encoding of the raw bytes itself, which
+            # skips requests' charset lookup and response.text decoding.
+            raw = json.loads(response.content)
         except ValueError as exc:
             logging.warning("Jellyfin virtual folders parse failed error=%s", exc)
             return False, "Failed to parse Jellyfin virtual folders response", 502, None
 
-        if isinstance(folders, dict):
-            folders = [folders]
-
-        folders = sorted(
-            folders,
-            key=lambda f: (str(f.get("Name") or "").lower(), f.get("ItemId") or ""),
-        )
+        return True, "Jellyfin virtual folders listed", 200, _process_folders(raw)
 
-        logging.info("Jellyfin virtual folders count=%s", len(folders))
-        for folder in folders:
-            name = folder.get("Name")
-            item_id = folder.get("ItemId") or folder.get("Id")
-            collection_type = folder.get("CollectionType")
-            locations = folder.get("Locations") or []
-            path_infos = folder.get("LibraryOptions", {}).get("PathInfos") or []
-            if not locations and path_infos:
-                locations = [p.get("Path") for p in path_infos if p.get("Path")]
-            location_str = ", ".join([loc for loc in locations if loc]) or "-"
-            logging.info(
-                "Virtual folder\n  name=%s\n  item_id=%s\n  collection_type=%s\n  locations=%s",
-                name,
-                item_id,
-                collection_type,
-                location_str,
+    def _refresh_library(self, lib_id: str) -> Optional[str]:
+        try:
+            response = _SESSION.post(
+                # Ids come from request headers; keep them inside one path segment.
+                self._item_refresh_url.format(quote(lib_id, safe="")),
+                headers=self.headers,
+                params={"Recursive": "true"},
+                timeout=_REFRESH_TIMEOUT_SECONDS,
             )
+        except requests.RequestException as exc:
+            logging.warning(
+                "Jellyfin refresh failed for library_id=%s error=%s", lib_id, exc
+            )
+            return f"{lib_id} (error)"
+
+        if response.status_code == 204:
+            logging.info("Triggered Jellyfin refresh for library_id=%s", lib_id)
+            return None
 
-        return True, "Jellyfin virtual folders listed", 200, folders
+        logging.warning(
+            "Jellyfin refresh failed for library_id=%s status=%s",
+            lib_id,
+            response.status_code,
+        )
+        return f"{lib_id} (status {response.status_code})"
 
     def refresh(self, library_ids: Optional[List[str]] = None) -> JellyfinResult:
         if library_ids:
-            failures: List[str] = []
-            for lib_id in library_ids:
-                refresh_url = f"{self.base_url}/Items/{lib_id}/Refresh"
-                try:
-                    response = requests.post(
-                        refresh_url,
-                        headers=self.headers,
-                        params={"Recursive": "true"},
-                        timeout=10,
-                    )
-                except requests.RequestException as exc:
-                    logging.warning(
-                        "Jellyfin refresh failed for library_id=%s error=%s", lib_id, exc
-                    )
-                    failures.append(f"{lib_id} (error)")
-                    continue
-
-                if response.status_code == 204:
-                    logging.info("Triggered Jellyfin refresh for library_id=%s", lib_id)
-                else:
-                    logging.warning(
-                        "Jellyfin refresh failed for library_id=%s status=%s",
-                        lib_id,
-                        response.status_code,
-                    )
-                    failures.append(f"{lib_id} (status {response.status_code})")
+            if len(library_ids) == 1:
+                results = [self._refresh_library(library_ids[0])]
+            else:
+                executor = _get_refresh_executor()
+                results = executor.map(self._refresh_library, library_ids)
+            failures = [failure for failure in results if failure]
 
             if failures:
                 return False, f"Failed to refresh libraries: {', '.join(failures)}", 500
             return True, "Triggered Jellyfin refresh for selected libraries", 200
 
-        refresh_url = f"{self.base_url}/Library/Refresh"
         try:
-            response = requests.post(refresh_url, headers=self.headers, timeout=10)
+            response = _SESSION.post(
+                self._library_refresh_url,
+                headers=self.headers,
+                timeout=_REFRESH_TIMEOUT_SECONDS,
+            )
         except requests.RequestException as exc:
             logging.warning("Jellyfin refresh request failed error=%s", exc)
             return False, f"Failed to trigger Jellyfin: {exc}", 502
@@ -159,33 +298,81 @@ class JellyfinClient:
         return False, f"Failed to trigger Jellyfin ({response.status_code})", 500
 
 
+def describe_library(folder: Dict[str, Any]) -> Dict[str, Any]:
+    get = folder.get
+    locations = get("Locations")
+    if not locations:
+        # Fall back to the configured paths; the filter below drops empty ones.
+        path_infos = (get("LibraryOptions") or {}).get("PathInfos") or ()
+        locations = [info.get("Path") for info in path_infos]
+    return {
+        "name": get("Name"),
+        "itemId": get("ItemId") or get("Id"),
+        "collectionType": get("CollectionType"),
+        "locations": [loc for loc in locations if loc],
+    }
+
+
+def _process_folders(raw: Any) -> _VirtualFoldersEntry:
+    if isinstance(raw, dict):
+        raw = [raw]
+
+    keyed = [
+        ((str(f.get("Name") or "").lower(), f.get("ItemId") or ""), f) for f in raw
+    ]
+    keyed.sort(key=itemgetter(0))
+    libraries = [describe_library(f) for _, f in keyed]
+    # Full folders carry LibraryOptions blobs; only keep what callers read.
+    folders = [
+        {key: f[key] for key in _FOLDER_FIELDS if key in f} for _, f in keyed
+    ]
+
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        lines = [
+            "Virtual folder\n  name=%s\n  item_id=%s\n  collection_type=%s\n  locations=%s"
+            % (
+                library["name"],
+                library["itemId"],
+                library["collectionType"],
+                ", ".join(library["locations"]) or "-",
+            )
+            for library in libraries
+        ]
+        logging.info(
+            "Jellyfin virtual folders count=%s%s",
+            len(folders),
+            "".join("\n" + line for line in lines),
+        )
+
+    return folders, libraries
+
+
 def select_library_ids_by_collection(
-    folders: List[Dict[str, Any]], requested_types: List[str]
+    folders: List[Dict[str, Any]], requested_types: Sequence[str]
 ) -> Tuple[List[str], List[str], List[str]]:
-    requested = set(requested_types)
-    available_types = set()
-    selected_ids: List[str] = []
-
+    ids_by_type: Dict[str, List[str]] = {}
     for folder in folders:
-        ctype = (folder.get("CollectionType") or "").lower()
+        get = folder.get
+        ctype = (get("CollectionType") or "").lower()
         if not ctype:
             continue
-        available_types.add(ctype)
-        if ctype in requested:
-            item_id = folder.get("ItemId") or folder.get("Id")
-            if item_id:
-                selected_ids.append(item_id)
-
-    missing = sorted(requested - available_types)
-    return selected_ids, missing, sorted(available_types)
-
-
-def merge_ids(*lists_of_ids: Optional[List[str]]) -> List[str]:
-    seen = set()
-    merged: List[str] = []
-    for ids in lists_of_ids:
-        for value in ids or []:
-            if value and value not in seen:
-                merged.append(value)
-                seen.add(value)
-    return merged
+        ids = ids_by_type.setdefault(ctype, [])
+        item_id = get("ItemId") or get("Id")
+        if item_id:
+            ids.append(item_id)
+
+    requested = frozenset(t.lower() for t in requested_types)
+    selected_ids = [
+        item_id
+        for ctype, ids in ids_by_type.items()
+        if ctype in requested
+        for item_id in ids
+    ]
+    missing = sorted(requested.difference(ids_by_type))
+    return selected_ids, missing, sorted(ids_by_type)
+
+
+def merge_ids(*lists_of_ids: Optional[Sequence[str]]) -> List[str]:
+    return list(
+        dict.fromkeys(value for ids in lists_of_ids for value in ids or () if value)
+    )
@@ -1,14 +1,24 @@
 import logging
 import os
 
+# Matched against the werkzeug request line, e.g. "GET /health HTTP/1.1".
+_HEALTH_REQUEST = " /health "
+_HEALTH_REQUEST_WITH_QUERY = " /health?"
+
 
 class HealthLogFilter(logging.Filter):
     """Filter out health endpoint hits from werkzeug logs."""
 
     def filter(self, record: logging.LogRecord) -> bool:  # type: ignore[override]
-        args = getattr(record, "args", ())
-        # record.args[0] holds the request line, e.g. "GET /health HTTP/1.1"
-        return not (args and "/health" in str(args[0]))
+        args = record.args
+        if not args or not isinstance(args, tuple):
+            return True
+        request_line = args[0]
+        if not isinstance(request_line, str):
+            return True
+        return not (
+            _HEALTH_REQUEST in request_line or _HEALTH_REQUEST_WITH_QUERY in request_line
+        )
 
 
 def configure_logging() -> None:
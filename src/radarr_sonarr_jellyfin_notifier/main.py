@@ -1,10 +1,13 @@
 import os
 
-from flask import Flask, jsonify
+from flask import Flask
 
 from .logging_setup import configure_logging
 from .webhooks import webhooks_bp
 
+# Probes hit /health constantly; the body never changes, so skip encoding it.
+_HEALTH_BODY = b'{"status":"ok"}\n'
+
 
 def create_app() -> Flask:
     configure_logging()
@@ -13,7 +16,7 @@ def create_app() -> Flask:
 
     @app.route("/health", methods=["GET"])
     def health():
-        return jsonify({"status": "ok"}), 200
+        return app.response_class(_HEALTH_BODY, mimetype="application/json")
 
     return app
 
@@ -31,7 +34,7 @@ def _get_port() -> int:
 
 def main() -> None:
     port = _get_port()
-    app.run(host="0.0.0.0", port=port)
+    app.run(host="0.0.0.0", port=port, threaded=True)
 
 
 if __name__ == "__main__":
@@ -1,13 +1,24 @@
+import bisect
+import heapq
 import ipaddress
 import json
 import logging
+import math
 import os
 import threading
 import time
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Optional, Tuple
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, List, Mapping, Optional, Sequence, Tuple
 
 from flask import Blueprint, current_app, jsonify, request
+from werkzeug.http import generate_etag
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from .jellyfin import (
     JellyfinClient,
@@ -17,10 +28,31 @@ from .jellyfin import (
 
 webhooks_bp = Blueprint("webhooks", __name__)
 
-_RATE_LIMIT_STATE: Dict[str, List[float]] = {}
+# Shared read-only stand-in for absent payload sections.
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
+_STRIP_WHITESPACE = str.maketrans("", "", " \t\r\n")
+
+# Token bucket per address: (tokens left, monotonic time of last update).
+_RATE_LIMIT_STATE: Dict[str, Tuple[float, float]] = {}
+# Addresses whose bucket has refilled are dropped once this many are tracked,
+# at most once per window so a table of busy buckets is not rescanned per
+# request. Past the hard cap the least recently seen address is evicted.
+_RATE_LIMIT_SWEEP_THRESHOLD = 1024
+_RATE_LIMIT_MAX_ENTRIES = 16384
+_rate_limit_next_sweep = 0.0
 _RATE_LIMIT_LOCK = threading.Lock()
 _REFRESH_QUEUE: Dict[Tuple[str, str], "RefreshBucket"] = {}
 _REFRESH_COND = threading.Condition()
+# (next_run, key) min-heap over _REFRESH_QUEUE, pruned lazily by the worker.
+_REFRESH_HEAP: List[Tuple[float, Tuple[str, str]]] = []
+# Time source for the refresh schedule; tests swap it for a fake clock.
+_clock = time.time
+_INFLIGHT_REFRESHES: Dict[Tuple[str, str, FrozenSet[str]], "InflightRefresh"] = {}
+_INFLIGHT_LOCK = threading.Lock()
+# Bounded because credentials come from request headers.
+_MAX_CLIENTS = 16
+_CLIENTS: Dict[Tuple[str, str], JellyfinClient] = {}
+_CLIENTS_LOCK = threading.Lock()
 
 
 @dataclass
@@ -31,71 +63,165 @@ class RefreshBucket:
     first_seen: Optional[float] = None
 
 
-def _get_rate_limit_per_minute() -> int:
-    raw = os.getenv("JELLYFIN_NOTIFIER_RATE_LIMIT_PER_MINUTE", "")
+@dataclass
+class InflightRefresh:
+    done: threading.Event = field(default_factory=threading.Event)
+    result: Optional[Tuple[bool, str, int]] = None
+
+
+@dataclass
+class WebhookContext:
+    jellyfin_url: str
+    jellyfin_api_key: str
+    library_ids: Tuple[str, ...]
+    collection_types: Tuple[str, ...]
+
+
+# The environment is still read on every call, but each distinct raw value is
+# parsed only once.
+@lru_cache(maxsize=16)
+def _parse_non_negative_int(raw: str, default: int, label: str) -> int:
     if not raw:
-        return 0
+        return default
     try:
-        limit = int(raw)
+        value = int(raw)
     except ValueError:
-        logging.warning("Invalid rate limit value: %s", raw)
-        return 0
-    return max(0, limit)
+        logging.warning("Invalid %s value: %s", label, raw)
+        return default
+    return max(0, value)
+
+
+def _get_rate_limit_per_minute() -> int:
+    raw = os.getenv("JELLYFIN_NOTIFIER_RATE_LIMIT_PER_MINUTE", "")
+    return _parse_non_negative_int(raw, 0, "rate limit")
 
 
 def _get_refresh_debounce_seconds() -> int:
     raw = os.getenv("JELLYFIN_NOTIFIER_REFRESH_DEBOUNCE_SECONDS", "")
-    if not raw:
-        return 10
-    try:
-        seconds = int(raw)
-    except ValueError:
-        logging.warning("Invalid refresh debounce value: %s", raw)
-        return 10
-    return max(0, seconds)
+    return _parse_non_negative_int(raw, 10, "refresh debounce")
 
 
 def _get_refresh_max_wait_seconds() -> int:
     raw = os.getenv("JELLYFIN_NOTIFIER_REFRESH_MAX_WAIT_SECONDS", "")
-    if not raw:
-        return 60
-    try:
-        seconds = int(raw)
-    except ValueError:
-        logging.warning("Invalid refresh max wait value: %s", raw)
-        return 60
-    return max(0, seconds)
+    return _parse_non_negative_int(raw, 60, "refresh max wait")
+
+
+# Per IP version: sorted starts and matching ends of disjoint address ranges.
+_AllowlistIndex = Mapping[int, Tuple[Tuple[int, ...], Tuple[int, ...]]]
 
 
-def _parse_allowlist() -> Tuple[List[Any], Optional[str]]:
-    raw = os.getenv("JELLYFIN_NOTIFIER_ALLOWLIST", "")
+def _parse_allowlist() -> Tuple[_AllowlistIndex, Optional[str]]:
+    return _parse_allowlist_value(os.getenv("JELLYFIN_NOTIFIER_ALLOWLIST", ""))
+
+
+@lru_cache(maxsize=4)
+def _parse_allowlist_value(raw: str) -> Tuple[_AllowlistIndex, Optional[str]]:
     entries = [part.strip() for part in raw.split(",") if part.strip()]
     if not entries:
-        return [], None
-    networks: List[Any] = []
+        return _EMPTY, None
+    by_version: Dict[int, List[Any]] = {}
     for entry in entries:
         try:
-            networks.append(ipaddress.ip_network(entry, strict=False))
+            network = ipaddress.ip_network(entry, strict=False)
         except ValueError:
             logging.warning("Invalid allowlist entry: %s", entry)
-            return [], f"Invalid allowlist entry: {entry}"
-    return networks, None
+            return _EMPTY, f"Invalid allowlist entry: {entry}"
+        by_version.setdefault(network.version, []).append(network)
+    # Merged ranges are disjoint and sorted, so only the last range starting
+    # at or below an address can contain it (see _allowlist_contains).
+    index: Dict[int, Any] = {}
+    for version, networks in by_version.items():
+        merged = list(ipaddress.collapse_addresses(networks))
+        index[version] = (
+            tuple(int(network.network_address) for network in merged),
+            tuple(int(network.broadcast_address) for network in merged),
+        )
+    return MappingProxyType(index), None
 
 
-def _is_rate_limited(
+def _allowlist_contains(allowlist: _AllowlistIndex, ip: Any) -> bool:
+    starts, ends = allowlist.get(ip.version, ((), ()))
+    addr = int(ip)
+    pos = bisect.bisect_right(starts, addr) - 1
+    return pos >= 0 and addr <= ends[pos]
+
+
+def _check_rate_limit(
     remote_addr: str, limit: int, window_seconds: int = 60
-) -> bool:
-    now = time.time()
+) -> Optional[int]:
+    global _rate_limit_next_sweep
+    now = time.monotonic()
+    rate = limit / window_seconds
     with _RATE_LIMIT_LOCK:
-        timestamps = _RATE_LIMIT_STATE.get(remote_addr, [])
-        cutoff = now - window_seconds
-        timestamps = [ts for ts in timestamps if ts > cutoff]
-        if len(timestamps) >= limit:
-            _RATE_LIMIT_STATE[remote_addr] = timestamps
-            return True
-        timestamps.append(now)
-        _RATE_LIMIT_STATE[remote_addr] = timestamps
-        return False
+        state = _RATE_LIMIT_STATE
+        if len(state) >= _RATE_LIMIT_SWEEP_THRESHOLD and now >= _rate_limit_next_sweep:
+            _sweep_rate_limit_state(now, limit, rate)
+            _rate_limit_next_sweep = now + window_seconds
+        # Re-inserting keeps the dict ordered from least to most recently seen.
+        tokens, last = state.pop(remote_addr, (limit, now))
+        if len(state) >= _RATE_LIMIT_MAX_ENTRIES:
+            del state[next(iter(state))]
+        tokens = min(limit, tokens + (now - last) * rate)
+        if tokens < 1:
+            state[remote_addr] = (tokens, now)
+            return max(1, math.ceil((1 - tokens) / rate))
+        state[remote_addr] = (tokens - 1, now)
+        return None
+
+
+def _sweep_rate_limit_state(now: float, limit: int, rate: float) -> None:
+    # A bucket that has refilled completely carries no state worth keeping.
+    full = [
+        addr
+        for addr, (tokens, last) in _RATE_LIMIT_STATE.items()
+        if tokens + (now - last) * rate >= limit
+    ]
+    for addr in full:
+        del _RATE_LIMIT_STATE[addr]
+
+
+def _get_client(jellyfin_url: str, jellyfin_api_key: str) -> JellyfinClient:
+    key = (jellyfin_url, jellyfin_api_key)
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            if len(_CLIENTS) >= _MAX_CLIENTS:
+                _CLIENTS.clear()
+            client = JellyfinClient(jellyfin_url, jellyfin_api_key)
+            _CLIENTS[key] = client
+        return client
+
+
+def _refresh_now(
+    jellyfin_url: str, jellyfin_api_key: str, library_ids: Optional[List[str]]
+) -> Tuple[bool, str, int]:
+    key = (jellyfin_url, jellyfin_api_key, frozenset(library_ids or ()))
+    with _INFLIGHT_LOCK:
+        inflight = _INFLIGHT_REFRESHES.get(key)
+        leader = inflight is None
+        if leader:
+            inflight = InflightRefresh()
+            _INFLIGHT_REFRESHES[key] = inflight
+
+    if not leader:
+        if inflight.done.wait(timeout=15) and inflight.result is not None:
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                logging.info(
+                    "Refresh coalesced with in-flight request targets=%s",
+                    "(all)" if not library_ids else ", ".join(library_ids),
+                )
+            return inflight.result
+        client = _get_client(jellyfin_url, jellyfin_api_key)
+        return client.refresh(library_ids=library_ids or None)
+
+    try:
+        client = _get_client(jellyfin_url, jellyfin_api_key)
+        inflight.result = client.refresh(library_ids=library_ids or None)
+        return inflight.result
+    finally:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT_REFRESHES.pop(key, None)
+        inflight.done.set()
 
 
 def _enqueue_refresh_request(
@@ -104,11 +230,10 @@ def _enqueue_refresh_request(
     debounce_seconds = _get_refresh_debounce_seconds()
     max_wait_seconds = _get_refresh_max_wait_seconds()
     if debounce_seconds <= 0:
-        client = JellyfinClient(jellyfin_url, jellyfin_api_key)
-        return client.refresh(library_ids=library_ids or None)
+        return _refresh_now(jellyfin_url, jellyfin_api_key, library_ids)
 
     key = (jellyfin_url, jellyfin_api_key)
-    now = time.time()
+    now = _clock()
     with _REFRESH_COND:
         bucket = _REFRESH_QUEUE.get(key)
         if bucket is None:
@@ -127,56 +252,59 @@ def _enqueue_refresh_request(
             max_deadline = bucket.first_seen + max_wait_seconds
             if scheduled > max_deadline:
                 scheduled = max_deadline
-        bucket.next_run = scheduled
-        _REFRESH_COND.notify()
-
-    target_desc = "(all)" if not library_ids else ", ".join(library_ids)
-    logging.info(
-        "Refresh queued targets=%s delay_seconds=%s max_wait_seconds=%s",
-        target_desc,
-        debounce_seconds,
-        max_wait_seconds,
-    )
+        if bucket.next_run != scheduled:
+            bucket.next_run = scheduled
+            heapq.heappush(_REFRESH_HEAP, (scheduled, key))
+            # The worker already sleeps until the earliest deadline; only wake
+            # it when this bucket moved that deadline forward.
+            if _REFRESH_HEAP[0] == (scheduled, key):
+                _REFRESH_COND.notify()
+
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        logging.info(
+            "Refresh queued targets=%s delay_seconds=%s max_wait_seconds=%s",
+            "(all)" if not library_ids else ", ".join(library_ids),
+            debounce_seconds,
+            max_wait_seconds,
+        )
     return True, "Refresh queued", 202
 
 
 def _get_next_due_bucket() -> Optional[Tuple[Tuple[str, str], RefreshBucket, float]]:
-    if not _REFRESH_QUEUE:
-        return None
-    key = min(
-        _REFRESH_QUEUE,
-        key=lambda k: _REFRESH_QUEUE[k].next_run or float("inf"),
-    )
-    bucket = _REFRESH_QUEUE.get(key)
-    if not bucket or bucket.next_run is None:
-        return None
-    return key, bucket, bucket.next_run
+    while _REFRESH_HEAP:
+        run_at, key = _REFRESH_HEAP[0]
+        bucket = _REFRESH_QUEUE.get(key)
+        # Rescheduled or already drained buckets leave stale entries behind.
+        if bucket is None or bucket.next_run != run_at:
+            heapq.heappop(_REFRESH_HEAP)
+            continue
+        return key, bucket, run_at
+    return None
 
 
-def _refresh_worker() -> None:
+def _pop_due_buckets(now: float) -> List[Tuple[Tuple[str, str], RefreshBucket]]:
+    due: List[Tuple[Tuple[str, str], RefreshBucket]] = []
     while True:
-        with _REFRESH_COND:
-            while True:
-                next_item = _get_next_due_bucket()
-                if not next_item:
-                    _REFRESH_COND.wait()
-                    continue
-                key, bucket, run_at = next_item
-                delay = run_at - time.time()
-                if delay > 0:
-                    _REFRESH_COND.wait(timeout=delay)
-                    continue
-                _REFRESH_QUEUE.pop(key, None)
-                break
-
-        jellyfin_url, jellyfin_api_key = key
+        next_item = _get_next_due_bucket()
+        if not next_item or next_item[2] > now:
+            return due
+        key, bucket, _ = next_item
+        heapq.heappop(_REFRESH_HEAP)
+        del _REFRESH_QUEUE[key]
+        due.append((key, bucket))
+
+
+def _run_refreshes(due: List[Tuple[Tuple[str, str], RefreshBucket]]) -> None:
+    # Buckets are keyed by (url, api_key); each refresh runs only with the key
+    # its own webhooks sent, so one caller's credentials never cover another's.
+    for (jellyfin_url, jellyfin_api_key), bucket in due:
         if bucket.pending_all or not bucket.pending_ids:
             targets = None
             target_desc = "(all)"
         else:
             targets = bucket.pending_ids
-            target_desc = ", ".join(bucket.pending_ids)
-        client = JellyfinClient(jellyfin_url, jellyfin_api_key)
+            target_desc = ", ".join(targets)
+        client = _get_client(jellyfin_url, jellyfin_api_key)
         ok, message, status = client.refresh(library_ids=targets)
         if ok:
             logging.info("Refresh completed targets=%s status=%s", target_desc, status)
@@ -189,6 +317,27 @@ def _refresh_worker() -> None:
             )
 
 
+def _drain_due_refreshes(wait: bool = False) -> None:
+    with _REFRESH_COND:
+        while wait:
+            next_item = _get_next_due_bucket()
+            if not next_item:
+                _REFRESH_COND.wait()
+                continue
+            delay = next_item[2] - _clock()
+            if delay <= 0:
+                break
+            _REFRESH_COND.wait(timeout=delay)
+        due = _pop_due_buckets(_clock())
+
+    _run_refreshes(due)
+
+
+def _refresh_worker() -> None:
+    while True:
+        _drain_due_refreshes(wait=True)
+
+
 _WORKER_THREAD = threading.Thread(
     target=_refresh_worker, name="refresh-worker", daemon=True
 )
@@ -214,7 +363,7 @@ def _enforce_request_restrictions():
                 request.path,
             )
             return "Forbidden", 403
-        if not any(ip in network for network in allowlist):
+        if not _allowlist_contains(allowlist, ip):
             logging.warning(
                 "Request rejected remote_addr=%s not in allowlist path=%s",
                 remote_addr,
@@ -224,65 +373,179 @@ def _enforce_request_restrictions():
     limit = _get_rate_limit_per_minute()
     if limit > 0:
         key = remote_addr or "unknown"
-        if _is_rate_limited(key, limit):
+        retry_after = _check_rate_limit(key, limit)
+        if retry_after is not None:
             logging.warning(
                 "Rate limit exceeded remote_addr=%s path=%s",
                 remote_addr,
                 request.path,
             )
-            return "Rate limit exceeded", 429, {"Retry-After": "60"}
+            return "Rate limit exceeded", 429, {"Retry-After": str(retry_after)}
     return None
 
 
 def is_test_event(event_type: Any) -> bool:
-    return isinstance(event_type, str) and event_type.lower() == "test"
+    # The length check spares the lowercased copy for every regular event.
+    return (
+        isinstance(event_type, str)
+        and len(event_type) == 4
+        and event_type.lower() == "test"
+    )
 
 
-def parse_library_ids_header(req) -> List[str]:
-    raw = req.headers.get("X-Jellyfin-Library-Ids", "")
+# Radarr/Sonarr send the same configured headers on every webhook, so each
+# distinct value is tokenized once; tuples keep the cached results immutable.
+@lru_cache(maxsize=64)
+def _split_library_ids(raw: Optional[str]) -> Tuple[str, ...]:
     if not raw:
-        return []
-    return [part.strip() for part in raw.split(",") if part.strip()]
+        return ()
+    # Library ids are GUIDs, so dropping all whitespace up front is safe.
+    return tuple(part for part in raw.translate(_STRIP_WHITESPACE).split(",") if part)
 
 
-def parse_collection_types_header(req) -> List[str]:
-    raw = req.headers.get("X-Jellyfin-Collection-Types", "")
+@lru_cache(maxsize=64)
+def _split_collection_types(raw: Optional[str]) -> Tuple[str, ...]:
     if not raw:
-        return []
-    return [part.strip().lower() for part in raw.split(",") if part.strip()]
+        return ()
+    # Jellyfin collection types are single words (movies, tvshows, ...).
+    raw = raw.translate(_STRIP_WHITESPACE).lower()
+    return tuple(part for part in raw.split(",") if part)
 
 
-def extract_jellyfin_headers(
-    req,
+def parse_library_ids_header(req) -> List[str]:
+    return list(_split_library_ids(req.headers.get("X-Jellyfin-Library-Ids")))
+
+
+def parse_collection_types_header(req) -> List[str]:
+    return list(
+        _split_collection_types(req.headers.get("X-Jellyfin-Collection-Types"))
+    )
+
+
+def _resolve_credentials(
+    header_url: Optional[str],
+    header_api_key: Optional[str],
+    query: Mapping[str, str],
+    allow_query_params: bool,
 ) -> Tuple[Optional[str], Optional[str], Optional[Tuple[str, int]]]:
-    missing = []
-    jellyfin_url = req.headers.get("X-Jellyfin-Url") or os.getenv("JELLYFIN_URL")
-    jellyfin_api_key = req.headers.get("X-Jellyfin-Api-Key") or os.getenv(
-        "JELLYFIN_API_KEY"
+    jellyfin_url = header_url or query.get("url") or os.getenv("JELLYFIN_URL")
+    jellyfin_api_key = (
+        header_api_key or query.get("api_key") or os.getenv("JELLYFIN_API_KEY")
     )
+    if jellyfin_url and jellyfin_api_key:
+        return jellyfin_url, jellyfin_api_key, None
 
+    missing = []
     if not jellyfin_url:
-        missing.append("X-Jellyfin-Url or JELLYFIN_URL")
+        missing.append(
+            "X-Jellyfin-Url header, url query param, or JELLYFIN_URL"
+            if allow_query_params
+            else "X-Jellyfin-Url or JELLYFIN_URL"
+        )
     if not jellyfin_api_key:
-        missing.append("X-Jellyfin-Api-Key or JELLYFIN_API_KEY")
+        missing.append(
+            "X-Jellyfin-Api-Key header, api_key query param, or JELLYFIN_API_KEY"
+            if allow_query_params
+            else "X-Jellyfin-Api-Key or JELLYFIN_API_KEY"
+        )
 
-    if missing:
-        joined = ", ".join(missing)
-        logging.warning("Rejecting request missing credentials=%s", joined)
-        return None, None, (f"Missing credentials: {joined}", 400)
+    joined = ", ".join(missing)
+    logging.warning("Rejecting request missing credentials=%s", joined)
+    return None, None, (f"Missing credentials: {joined}", 400)
 
-    return jellyfin_url, jellyfin_api_key, None
+
+def extract_jellyfin_headers(
+    req, allow_query_params: bool = False
+) -> Tuple[Optional[str], Optional[str], Optional[Tuple[str, int]]]:
+    return _resolve_credentials(
+        req.headers.get("X-Jellyfin-Url"),
+        req.headers.get("X-Jellyfin-Api-Key"),
+        req.args if allow_query_params else _EMPTY,
+        allow_query_params,
+    )
 
 
-def _pretty_json(payload: Dict[str, Any], status: int = 200):
-    return current_app.response_class(
-        json.dumps(payload, indent=2), status=status, mimetype="application/json"
+def _read_webhook_context(
+    req,
+) -> Tuple[Optional[WebhookContext], Optional[Tuple[str, int]]]:
+    # Read the raw WSGI keys directly instead of going through
+    # EnvironHeaders, which rebuilds the HTTP_* name on every lookup.
+    environ = req.environ
+    jellyfin_url, jellyfin_api_key, error = _resolve_credentials(
+        environ.get("HTTP_X_JELLYFIN_URL"),
+        environ.get("HTTP_X_JELLYFIN_API_KEY"),
+        _EMPTY,
+        False,
+    )
+    if error:
+        return None, error
+    return (
+        WebhookContext(
+            jellyfin_url,
+            jellyfin_api_key,
+            _split_library_ids(environ.get("HTTP_X_JELLYFIN_LIBRARY_IDS")),
+            _split_collection_types(environ.get("HTTP_X_JELLYFIN_COLLECTION_TYPES")),
+        ),
+        None,
     )
 
 
-def _log_radarr_event(data: Dict[str, Any]) -> None:
-    movie = data.get("movie", {}) or {}
-    movie_file = data.get("movieFile", {}) or {}
+def _wants_pretty_json(req) -> bool:
+    pretty = req.args.get("pretty")
+    if pretty is not None:
+        return pretty.lower() not in ("0", "false", "no")
+    # Only clients that rank HTML above JSON (browsers) get indented output;
+    # API clients and */* (curl, requests) get the compact form.
+    accept = req.accept_mimetypes
+    return accept["text/html"] > accept["application/json"]
+
+
+def _dumps_json(payload: Dict[str, Any], pretty: bool) -> bytes:
+    # orjson is an optional speedup. The fallback mirrors its UTF-8 output and
+    # separators, which covers the strings, lists and nulls served here.
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_INDENT_2 if pretty else 0)
+    if pretty:
+        return json.dumps(payload, ensure_ascii=False, indent=2).encode()
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _json_response(payload: Dict[str, Any], status: int = 200, etag: bool = False):
+    pretty = _wants_pretty_json(request)
+    body = _dumps_json(payload, pretty)
+    # Hand Werkzeug the bytes as-is instead of re-chunking a str.
+    response = current_app.response_class(
+        body,
+        status=status,
+        mimetype="application/json",
+        direct_passthrough=True,
+    )
+    response.vary.add("Accept")
+    if etag:
+        # Hash the compact form so both indentations share one weak ETag.
+        canonical = _dumps_json(payload, False) if pretty else body
+        response.set_etag(generate_etag(canonical), weak=True)
+    return response
+
+
+def _get_payload(req) -> Mapping[str, Any]:
+    # Same contract as get_json(silent=True), minus Flask's JSON provider
+    # dispatch and body caching; nothing else reads the body.
+    if not req.is_json:
+        return _EMPTY
+    raw = req.get_data(cache=False)
+    try:
+        payload = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except ValueError:
+        return _EMPTY
+    return payload if isinstance(payload, dict) else _EMPTY
+
+
+def _log_radarr_event(data: Mapping[str, Any]) -> None:
+    if not logging.getLogger().isEnabledFor(logging.INFO):
+        return
+    movie = data.get("movie") or _EMPTY
+    movie_file = data.get("movieFile") or _EMPTY
     logging.info(
         "Webhook received source=radarr event_type=%s endpoint=%s remote=%s title=%s year=%s file=%s",
         data.get("eventType"),
@@ -294,9 +557,11 @@ def _log_radarr_event(data: Dict[str, Any]) -> None:
     )
 
 
-def _log_sonarr_event(data: Dict[str, Any]) -> None:
-    series = data.get("series", {}) or {}
-    episode_file = data.get("episodeFile", {}) or {}
+def _log_sonarr_event(data: Mapping[str, Any]) -> None:
+    if not logging.getLogger().isEnabledFor(logging.INFO):
+        return
+    series = data.get("series") or _EMPTY
+    episode_file = data.get("episodeFile") or _EMPTY
     logging.info(
         "Webhook received source=sonarr event_type=%s endpoint=%s remote=%s series=%s episode_path=%s",
         data.get("eventType"),
@@ -308,11 +573,14 @@ def _log_sonarr_event(data: Dict[str, Any]) -> None:
 
 
 def _resolve_collection_types(
-    client: JellyfinClient, collection_types: List[str]
+    client: JellyfinClient,
+    collection_types: Sequence[str],
+    folders: Optional[List[Dict[str, Any]]] = None,
 ) -> Tuple[Optional[List[str]], Optional[Tuple[str, int]]]:
-    ok, vf_message, vf_status, folders = client.fetch_virtual_folders()
-    if not ok:
-        return None, (vf_message, vf_status)
+    if folders is None:
+        ok, vf_message, vf_status, folders = client.fetch_virtual_folders()
+        if not ok:
+            return None, (vf_message, vf_status)
 
     selected_ids, missing_types, available_types = select_library_ids_by_collection(
         folders or [], collection_types
@@ -339,105 +607,37 @@ def _resolve_collection_types(
 
 @webhooks_bp.route("/radarr-webhook", methods=["POST"])
 def handle_radarr_event():
-    data: Dict[str, Any] = request.get_json(silent=True) or {}
+    data = _get_payload(request)
     _log_radarr_event(data)
-
-    jellyfin_url, jellyfin_api_key, error_response = extract_jellyfin_headers(request)
-    if error_response:
-        return error_response
-
-    client = JellyfinClient(jellyfin_url, jellyfin_api_key)
-    library_ids = parse_library_ids_header(request)
-    collection_types = parse_collection_types_header(request)
-
-    if is_test_event(data.get("eventType")):
-        ok, message, status = client.ping()
-        if ok:
-            logging.info(
-                "Test event ok source=radarr event_type=%s endpoint=%s remote=%s",
-                data.get("eventType"),
-                request.path,
-                request.remote_addr,
-            )
-        else:
-            return message, status
-
-        vf_ok, vf_message, vf_status, folders = client.fetch_virtual_folders()
-        if vf_ok:
-            selected_ids: List[str] = []
-            if collection_types:
-                selected_ids, missing_types, available_types = (
-                    select_library_ids_by_collection(folders or [], collection_types)
-                )
-                if missing_types:
-                    return (
-                        f"Unknown collection types: {', '.join(missing_types)}. "
-                        f"Available: {', '.join(available_types)}",
-                        400,
-                    )
-            combined_ids = merge_ids(library_ids, selected_ids)
-            if combined_ids:
-                logging.info(
-                    "Test event targets source=radarr event_type=%s endpoint=%s targets=%s",
-                    data.get("eventType"),
-                    request.path,
-                    ", ".join(combined_ids),
-                )
-            if collection_types:
-                logging.info(
-                    "Test event collection types source=radarr event_type=%s endpoint=%s collection_types=%s targets=%s",
-                    data.get("eventType"),
-                    request.path,
-                    ", ".join(collection_types),
-                    ", ".join(selected_ids) if selected_ids else "(none)",
-                )
-            return f"{message}; {vf_message}", 200
-        return vf_message, vf_status
-
-    resolved_ids: List[str] = []
-    if collection_types:
-        resolved_ids_or_error, error = _resolve_collection_types(
-            client, collection_types
-        )
-        if error:
-            return error
-        resolved_ids = resolved_ids_or_error or []
-
-    combined_ids = merge_ids(library_ids, resolved_ids)
-    targets = ", ".join(combined_ids) if combined_ids else "(all)"
-    logging.info(
-        "Refresh request source=radarr event_type=%s endpoint=%s targets=%s collection_types=%s",
-        data.get("eventType"),
-        request.path,
-        targets,
-        ", ".join(collection_types) if collection_types else "(none)",
-    )
-
-    _, refresh_message, refresh_status = _enqueue_refresh_request(
-        jellyfin_url, jellyfin_api_key, combined_ids or None
-    )
-    return refresh_message, refresh_status
+    return _handle_event("radarr", data)
 
 
 @webhooks_bp.route("/sonarr-webhook", methods=["POST"])
 def handle_sonarr_event():
-    data: Dict[str, Any] = request.get_json(silent=True) or {}
+    data = _get_payload(request)
     _log_sonarr_event(data)
+    return _handle_event("sonarr", data)
 
-    jellyfin_url, jellyfin_api_key, error_response = extract_jellyfin_headers(request)
+
+def _handle_event(source: str, data: Mapping[str, Any]):
+    event_type = data.get("eventType")
+
+    ctx, error_response = _read_webhook_context(request)
     if error_response:
         return error_response
 
-    client = JellyfinClient(jellyfin_url, jellyfin_api_key)
-    library_ids = parse_library_ids_header(request)
-    collection_types = parse_collection_types_header(request)
+    jellyfin_url, jellyfin_api_key = ctx.jellyfin_url, ctx.jellyfin_api_key
+    client = _get_client(jellyfin_url, jellyfin_api_key)
+    library_ids = ctx.library_ids
+    collection_types = ctx.collection_types
 
-    if is_test_event(data.get("eventType")):
+    if is_test_event(event_type):
         ok, message, status = client.ping()
         if ok:
             logging.info(
-                "Test event ok source=sonarr event_type=%s endpoint=%s remote=%s",
-                data.get("eventType"),
+                "Test event ok source=%s event_type=%s endpoint=%s remote=%s",
+                source,
+                event_type,
                 request.path,
                 request.remote_addr,
             )
@@ -448,30 +648,29 @@ def handle_sonarr_event():
         if vf_ok:
             selected_ids: List[str] = []
             if collection_types:
-                selected_ids, missing_types, available_types = (
-                    select_library_ids_by_collection(folders or [], collection_types)
+                matched_ids, error = _resolve_collection_types(
+                    client, collection_types, folders or []
                 )
-                if missing_types:
-                    return (
-                        f"Unknown collection types: {', '.join(missing_types)}. "
-                        f"Available: {', '.join(available_types)}",
-                        400,
-                    )
+                if error:
+                    return error
+                selected_ids = matched_ids or []
             combined_ids = merge_ids(library_ids, selected_ids)
             if combined_ids:
                 logging.info(
-                    "Test event targets source=sonarr event_type=%s endpoint=%s targets=%s",
-                    data.get("eventType"),
+                    "Test event targets source=%s event_type=%s endpoint=%s targets=%s",
+                    source,
+                    event_type,
                     request.path,
                     ", ".join(combined_ids),
                 )
             if collection_types:
                 logging.info(
-                    "Test event collection types source=sonarr event_type=%s endpoint=%s collection_types=%s targets=%s",
-                    data.get("eventType"),
+                    "Test event collection types source=%s event_type=%s endpoint=%s collection_types=%s targets=%s",
+                    source,
+                    event_type,
                     request.path,
                     ", ".join(collection_types),
-                    ", ".join(selected_ids) if selected_ids else "(none)",
+                    ", ".join(selected_ids),
                 )
             return f"{message}; {vf_message}", 200
         return vf_message, vf_status
@@ -486,14 +685,15 @@ def handle_sonarr_event():
         resolved_ids = resolved_ids_or_error or []
 
     combined_ids = merge_ids(library_ids, resolved_ids)
-    targets = ", ".join(combined_ids) if combined_ids else "(all)"
-    logging.info(
-        "Refresh request source=sonarr event_type=%s endpoint=%s targets=%s collection_types=%s",
-        data.get("eventType"),
-        request.path,
-        targets,
-        ", ".join(collection_types) if collection_types else "(none)",
-    )
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        logging.info(
+            "Refresh request source=%s event_type=%s endpoint=%s targets=%s collection_types=%s",
+            source,
+            event_type,
+            request.path,
+            ", ".join(combined_ids) if combined_ids else "(all)",
+            ", ".join(collection_types) if collection_types else "(none)",
+        )
 
     _, refresh_message, refresh_status = _enqueue_refresh_request(
         jellyfin_url, jellyfin_api_key, combined_ids or None
@@ -503,48 +703,26 @@ def handle_sonarr_event():
 
 @webhooks_bp.route("/libraries", methods=["GET"])
 def list_libraries():
-    jellyfin_url = (
-        request.headers.get("X-Jellyfin-Url")
-        or request.args.get("url")
-        or os.getenv("JELLYFIN_URL")
+    jellyfin_url, jellyfin_api_key, error_response = extract_jellyfin_headers(
+        request, allow_query_params=True
     )
-    jellyfin_api_key = (
-        request.headers.get("X-Jellyfin-Api-Key")
-        or request.args.get("api_key")
-        or os.getenv("JELLYFIN_API_KEY")
-    )
-    missing = []
-    if not jellyfin_url:
-        missing.append("X-Jellyfin-Url header, url query param, or JELLYFIN_URL")
-    if not jellyfin_api_key:
-        missing.append(
-            "X-Jellyfin-Api-Key header, api_key query param, or JELLYFIN_API_KEY"
-        )
-    if missing:
-        joined = ", ".join(missing)
-        return f"Missing credentials: {joined}", 400
+    if error_response:
+        return error_response
 
-    client = JellyfinClient(jellyfin_url, jellyfin_api_key)
-    ok, message, status, folders = client.fetch_virtual_folders()
+    client = _get_client(jellyfin_url, jellyfin_api_key)
+    ok, message, status, libraries = client.fetch_libraries()
     if not ok:
         return message, status
 
-    libraries = []
-    for folder in folders or []:
-        name = folder.get("Name")
-        item_id = folder.get("ItemId") or folder.get("Id")
-        collection_type = folder.get("CollectionType")
-        locations = folder.get("Locations") or []
-        path_infos = folder.get("LibraryOptions", {}).get("PathInfos") or []
-        if not locations and path_infos:
-            locations = [p.get("Path") for p in path_infos if p.get("Path")]
-        libraries.append(
-            {
-                "name": name,
-                "itemId": item_id,
-                "collectionType": collection_type,
-                "locations": [p for p in locations if p],
-            }
-        )
-
-    return _pretty_json({"libraries": libraries})
+    collection_types = _split_collection_types(request.args.get("collection_type"))
+    if collection_types:
+        wanted = frozenset(collection_types)
+        libraries = [
+            library
+            for library in libraries or ()
+            if (library["collectionType"] or "").lower() in wanted
+        ]
+
+    # Dashboards poll this; let them revalidate instead of re-downloading.
+    response = _json_response({"libraries": libraries}, etag=True)
+    return response.make_conditional(request)
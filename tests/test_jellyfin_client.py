@@ -1,222 +1,451 @@
+import json
+import socket
+import time
 import unittest
+from types import SimpleNamespace
 from unittest.mock import Mock, patch
 
 import requests
 
+import radarr_sonarr_jellyfin_notifier.jellyfin as jellyfin
 from radarr_sonarr_jellyfin_notifier.jellyfin import JellyfinClient
 
 
-def _make_response(status_code=200, json_data=None, json_exc=None):
-    resp = Mock()
-    resp.status_code = status_code
-    if json_exc is not None:
-        resp.json.side_effect = json_exc
-    else:
-        resp.json.return_value = json_data
-    return resp
+def _make_response(status_code=200, json_data=None, content=None):
+    # The client only reads these two attributes, so a plain namespace is
+    # enough and much cheaper to build than a Mock.
+    if content is None:
+        content = json.dumps(json_data).encode()
+    return SimpleNamespace(status_code=status_code, content=content)
+
+
+_NO_CONTENT = _make_response(status_code=204)
 
 
 class JellyfinClientTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Clients hold no per-test state; the module caches are reset below.
+        cls.client = JellyfinClient("http://jf/", "key")
+        # Plain Mocks: the session methods are only called, never used with
+        # magic methods, so MagicMock's extra setup buys nothing.
+        get_patcher = patch.object(jellyfin._SESSION, "get", new_callable=Mock)
+        post_patcher = patch.object(jellyfin._SESSION, "post", new_callable=Mock)
+        cls.mock_get = get_patcher.start()
+        cls.addClassCleanup(get_patcher.stop)
+        cls.mock_post = post_patcher.start()
+        cls.addClassCleanup(post_patcher.stop)
+
     def setUp(self):
-        self.client = JellyfinClient("http://jf/", "key")
+        self._reset()
+
+    def _reset(self):
+        self.mock_get.reset_mock(return_value=True, side_effect=True)
+        self.mock_post.reset_mock(return_value=True, side_effect=True)
+        jellyfin._VIRTUAL_FOLDERS_CACHE.clear()
+        jellyfin._PING_FAILURE_CACHE.clear()
+
+    def tearDown(self):
+        jellyfin._VIRTUAL_FOLDERS_CACHE.clear()
+        jellyfin._PING_FAILURE_CACHE.clear()
 
     def test_base_url_strips_trailing_slash(self):
         self.assertEqual(self.client.base_url, "http://jf")
 
+    def test_session_retries_transient_errors(self):
+        retry = jellyfin._SESSION.get_adapter("http://jf").max_retries
+        self.assertEqual(retry.total, 3)
+        self.assertIn(503, retry.status_forcelist)
+        self.assertIn("POST", retry.allowed_methods)
+        self.assertFalse(retry.raise_on_status)
+        self.assertEqual(jellyfin._SESSION.headers["Accept"], "application/json")
+
     def test_headers_include_token(self):
         self.assertEqual(self.client.headers, {"X-Emby-Token": "key"})
 
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.get")
-    def test_ping_success(self, mock_get):
-        mock_get.side_effect = [Mock(), _make_response(status_code=200)]
+    def test_ping_success(self):
+        self.mock_get.return_value = _make_response(status_code=200)
         ok, message, status = self.client.ping()
         self.assertTrue(ok)
         self.assertEqual(status, 200)
         self.assertEqual(message, "Jellyfin connection and API key OK")
-        mock_get.assert_any_call("http://jf", timeout=5)
-        mock_get.assert_any_call(
+        self.mock_get.assert_called_once_with(
             "http://jf/System/Info",
             headers={"X-Emby-Token": "key"},
             timeout=5,
         )
 
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.get")
-    def test_ping_api_key_rejected(self, mock_get):
-        mock_get.side_effect = [Mock(), _make_response(status_code=401)]
-        ok, message, status = self.client.ping()
-        self.assertFalse(ok)
-        self.assertEqual(status, 401)
-        self.assertIn("API key rejected", message)
-
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.get")
-    def test_ping_system_info_failure(self, mock_get):
-        mock_get.side_effect = [Mock(), _make_response(status_code=500)]
-        ok, message, status = self.client.ping()
-        self.assertFalse(ok)
-        self.assertEqual(status, 502)
-        self.assertIn("Failed to reach Jellyfin", message)
-
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.get")
-    def test_ping_first_request_exception(self, mock_get):
-        mock_get.side_effect = requests.RequestException("boom")
-        ok, message, status = self.client.ping()
-        self.assertFalse(ok)
-        self.assertEqual(status, 502)
-        self.assertIn("Failed to reach Jellyfin", message)
-        self.assertEqual(mock_get.call_count, 1)
-
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.get")
-    def test_ping_system_info_exception(self, mock_get):
-        mock_get.side_effect = [Mock(), requests.RequestException("boom")]
-        ok, message, status = self.client.ping()
-        self.assertFalse(ok)
-        self.assertEqual(status, 502)
-        self.assertIn("Failed to reach Jellyfin", message)
+    def test_ping_failures(self):
+        cases = [
+            (_make_response(status_code=401), 401, "API key rejected"),
+            (_make_response(status_code=500), 502, "Failed to reach Jellyfin"),
+            (requests.ConnectionError("boom"), 502, "Failed to reach Jellyfin"),
+            (requests.ReadTimeout("slow"), 502, "timed out"),
+            (requests.RequestException("boom"), 502, "Failed to reach Jellyfin"),
+        ]
+        for outcome, expected_status, needle in cases:
+            with self.subTest(outcome=outcome):
+                self._reset()
+                if isinstance(outcome, Exception):
+                    self.mock_get.side_effect = outcome
+                else:
+                    self.mock_get.return_value = outcome
+                ok, message, status = self.client.ping()
+                self.assertFalse(ok)
+                self.assertEqual(status, expected_status)
+                self.assertIn(needle, message)
+                self.assertEqual(self.mock_get.call_count, 1)
 
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.get")
-    def test_fetch_virtual_folders_success_sorted(self, mock_get):
+    def test_fetch_virtual_folders_success_sorted(self):
         resp = _make_response(
             json_data=[
                 {"Name": "b", "ItemId": "2", "CollectionType": "movies"},
                 {"Name": "A", "ItemId": "1", "CollectionType": "tvshows"},
             ]
         )
-        mock_get.return_value = resp
+        self.mock_get.return_value = resp
         ok, message, status, folders = self.client.fetch_virtual_folders()
         self.assertTrue(ok)
         self.assertEqual(status, 200)
         self.assertEqual(message, "Jellyfin virtual folders listed")
         self.assertEqual([f["Name"] for f in folders], ["A", "b"])
 
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.get")
-    def test_fetch_virtual_folders_handles_dict(self, mock_get):
+    def test_fetch_virtual_folders_keeps_only_used_fields(self):
+        self.mock_get.return_value = _make_response(
+            json_data=[
+                {
+                    "Name": "Movies",
+                    "Id": "1",
+                    "CollectionType": "movies",
+                    "Locations": ["/data/movies"],
+                    "LibraryOptions": {"TypeOptions": [{"Type": "Movie"}]},
+                }
+            ]
+        )
+        ok, _, _, folders = self.client.fetch_virtual_folders()
+        self.assertTrue(ok)
+        self.assertEqual(
+            folders, [{"Name": "Movies", "Id": "1", "CollectionType": "movies"}]
+        )
+
+    def test_fetch_virtual_folders_handles_dict(self):
         resp = _make_response(json_data={"Name": "Only", "ItemId": "1"})
-        mock_get.return_value = resp
+        self.mock_get.return_value = resp
         ok, message, status, folders = self.client.fetch_virtual_folders()
         self.assertTrue(ok)
         self.assertEqual(status, 200)
         self.assertEqual(len(folders), 1)
         self.assertEqual(folders[0]["Name"], "Only")
 
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.get")
-    def test_fetch_virtual_folders_json_error(self, mock_get):
-        resp = _make_response(json_exc=ValueError("bad json"))
-        mock_get.return_value = resp
+    def test_fetch_virtual_folders_json_error(self):
+        resp = _make_response(content=b"{bad json")
+        self.mock_get.return_value = resp
         ok, message, status, folders = self.client.fetch_virtual_folders()
         self.assertFalse(ok)
         self.assertEqual(status, 502)
         self.assertIsNone(folders)
         self.assertIn("Failed to parse Jellyfin virtual folders response", message)
 
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.get")
-    def test_fetch_virtual_folders_api_key_rejected(self, mock_get):
+    def test_fetch_virtual_folders_api_key_rejected(self):
         resp = _make_response(status_code=401, json_data=[])
-        mock_get.return_value = resp
+        self.mock_get.return_value = resp
         ok, message, status, folders = self.client.fetch_virtual_folders()
         self.assertFalse(ok)
         self.assertEqual(status, 401)
         self.assertIsNone(folders)
         self.assertIn("API key rejected", message)
 
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.get")
-    def test_fetch_virtual_folders_bad_status(self, mock_get):
+    def test_fetch_virtual_folders_bad_status(self):
         resp = _make_response(status_code=500, json_data=[])
-        mock_get.return_value = resp
+        self.mock_get.return_value = resp
         ok, message, status, folders = self.client.fetch_virtual_folders()
         self.assertFalse(ok)
         self.assertEqual(status, 502)
         self.assertIsNone(folders)
         self.assertIn("Failed to fetch Jellyfin virtual folders", message)
 
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.get")
-    def test_fetch_virtual_folders_exception(self, mock_get):
-        mock_get.side_effect = requests.RequestException("boom")
+    def test_fetch_virtual_folders_exception(self):
+        self.mock_get.side_effect = requests.RequestException("boom")
         ok, message, status, folders = self.client.fetch_virtual_folders()
         self.assertFalse(ok)
         self.assertEqual(status, 502)
         self.assertIsNone(folders)
         self.assertIn("Failed to fetch Jellyfin virtual folders", message)
 
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.post")
-    def test_refresh_selected_libraries_success(self, mock_post):
-        mock_post.side_effect = [
-            _make_response(status_code=204),
-            _make_response(status_code=204),
+    def test_ping_failure_is_cached_briefly(self):
+        self.mock_get.side_effect = [
+            _make_response(status_code=500),
+            _make_response(status_code=200),
+        ]
+        self.assertFalse(self.client.ping()[0])
+        self.assertFalse(self.client.ping()[0])
+        self.assertEqual(self.mock_get.call_count, 1)
+
+        with patch.object(jellyfin, "_PING_FAILURE_CACHE_SECONDS", 0):
+            self.assertTrue(self.client.ping()[0])
+        self.assertEqual(jellyfin._PING_FAILURE_CACHE, {})
+
+    def test_ping_failure_cache_is_capped(self):
+        self.mock_get.return_value = _make_response(status_code=500)
+        clients = [JellyfinClient("http://jf", f"key{i}") for i in range(3)]
+        with patch.object(jellyfin, "_MAX_CACHE_ENTRIES", 2):
+            for client in clients:
+                client.ping()
+        self.assertEqual(
+            list(jellyfin._PING_FAILURE_CACHE),
+            [clients[1].cache_key, clients[2].cache_key],
+        )
+
+    def test_expired_ping_failure_is_dropped_on_read(self):
+        jellyfin._PING_FAILURE_CACHE[self.client.cache_key] = (
+            time.monotonic() - 60,
+            (False, "old", 502),
+        )
+
+        def fail(*args, **kwargs):
+            self.assertNotIn(self.client.cache_key, jellyfin._PING_FAILURE_CACHE)
+            raise requests.ConnectionError("down")
+
+        self.mock_get.side_effect = fail
+        self.assertIn("down", self.client.ping()[1])
+
+    def test_fetch_libraries_describes_sorted_folders(self):
+        self.mock_get.return_value = _make_response(
+            json_data=[
+                {"Name": "b", "ItemId": "2", "CollectionType": "movies"},
+                {"Name": "A", "Id": "1", "Locations": ["/data/a"]},
+            ]
+        )
+        ok, message, status, libraries = self.client.fetch_libraries()
+        self.assertTrue(ok)
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            libraries,
+            [
+                {
+                    "name": "A",
+                    "itemId": "1",
+                    "collectionType": None,
+                    "locations": ["/data/a"],
+                },
+                {
+                    "name": "b",
+                    "itemId": "2",
+                    "collectionType": "movies",
+                    "locations": [],
+                },
+            ],
+        )
+
+    def test_fetch_libraries_shares_cache_with_virtual_folders(self):
+        self.mock_get.return_value = _make_response(
+            json_data=[{"Name": "A", "ItemId": "1"}]
+        )
+        self.client.fetch_virtual_folders()
+        ok, _, _, libraries = self.client.fetch_libraries()
+        self.assertTrue(ok)
+        self.assertEqual(libraries[0]["itemId"], "1")
+        self.assertEqual(self.mock_get.call_count, 1)
+
+    def test_fetch_virtual_folders_uses_cache(self):
+        self.mock_get.return_value = _make_response(
+            json_data=[{"Name": "Movies", "ItemId": "1"}]
+        )
+        first = self.client.fetch_virtual_folders()
+        second = JellyfinClient("http://jf", "key").fetch_virtual_folders()
+        self.assertEqual(first, second)
+        self.assertEqual(self.mock_get.call_count, 1)
+
+        JellyfinClient("http://jf", "other").fetch_virtual_folders()
+        self.assertEqual(self.mock_get.call_count, 2)
+
+    def test_fetch_virtual_folders_cache_evicts_oldest(self):
+        self.mock_get.return_value = _make_response(json_data=[])
+        clients = [JellyfinClient("http://jf", f"key{i}") for i in range(3)]
+        with patch.object(jellyfin, "_MAX_CACHE_ENTRIES", 2):
+            for client in clients:
+                client.fetch_virtual_folders()
+            clients[2].fetch_virtual_folders()
+            self.assertEqual(self.mock_get.call_count, 3)
+            self.assertEqual(
+                list(jellyfin._VIRTUAL_FOLDERS_CACHE),
+                [clients[1].cache_key, clients[2].cache_key],
+            )
+
+    def test_fetch_virtual_folders_cache_expires(self):
+        self.mock_get.return_value = _make_response(json_data=[])
+        with patch.object(jellyfin, "_VIRTUAL_FOLDERS_CACHE_SECONDS", 0):
+            self.client.fetch_virtual_folders()
+            self.client.fetch_virtual_folders()
+        self.assertEqual(self.mock_get.call_count, 2)
+
+    def test_fetch_virtual_folders_does_not_cache_errors(self):
+        self.mock_get.side_effect = [
+            _make_response(status_code=500),
+            _make_response(json_data=[]),
+        ]
+        ok, _, _, _ = self.client.fetch_virtual_folders()
+        self.assertFalse(ok)
+        ok, _, _, _ = self.client.fetch_virtual_folders()
+        self.assertTrue(ok)
+        self.assertEqual(self.mock_get.call_count, 2)
+
+    def test_fetch_virtual_folders_serves_stale_on_server_error(self):
+        self.mock_get.side_effect = [
+            _make_response(json_data=[{"Name": "A", "ItemId": "1"}]),
+            _make_response(status_code=503),
+            _make_response(status_code=401),
+        ]
+        with patch.object(jellyfin, "_VIRTUAL_FOLDERS_CACHE_SECONDS", 0):
+            self.client.fetch_virtual_folders()
+            ok, _, status, folders = self.client.fetch_virtual_folders()
+            self.assertTrue(ok)
+            self.assertEqual(status, 200)
+            self.assertEqual(folders, [{"Name": "A", "ItemId": "1"}])
+            ok, _, status, folders = self.client.fetch_virtual_folders()
+            self.assertFalse(ok)
+            self.assertEqual(status, 401)
+            self.assertIsNone(folders)
+
+    def test_refresh_selected_libraries_success(self):
+        self.mock_post.side_effect = [
+            _NO_CONTENT,
+            _NO_CONTENT,
         ]
         ok, message, status = self.client.refresh(["a", "b"])
         self.assertTrue(ok)
         self.assertEqual(status, 200)
         self.assertIn("selected libraries", message)
-        mock_post.assert_any_call(
+        self.mock_post.assert_any_call(
             "http://jf/Items/a/Refresh",
             headers={"X-Emby-Token": "key"},
             params={"Recursive": "true"},
             timeout=10,
         )
-        mock_post.assert_any_call(
+        self.mock_post.assert_any_call(
             "http://jf/Items/b/Refresh",
             headers={"X-Emby-Token": "key"},
             params={"Recursive": "true"},
             timeout=10,
         )
 
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.post")
-    def test_refresh_selected_libraries_failure_status(self, mock_post):
-        mock_post.return_value = _make_response(status_code=500)
+    def test_refresh_selected_libraries_failure_status(self):
+        self.mock_post.return_value = _make_response(status_code=500)
         ok, message, status = self.client.refresh(["bad"])
         self.assertFalse(ok)
         self.assertEqual(status, 500)
         self.assertIn("bad (status 500)", message)
 
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.post")
-    def test_refresh_selected_libraries_failure_exception(self, mock_post):
-        mock_post.side_effect = requests.RequestException("boom")
+    def test_refresh_single_library_runs_inline(self):
+        self.mock_post.return_value = _NO_CONTENT
+        with patch.object(jellyfin, "_get_refresh_executor") as get_executor:
+            ok, _, _ = self.client.refresh(["a"])
+        self.assertTrue(ok)
+        get_executor.assert_not_called()
+
+    def test_refresh_selected_libraries_reuses_executor(self):
+        self.mock_post.return_value = _NO_CONTENT
+        self.client.refresh(["a", "b"])
+        executor = jellyfin._REFRESH_EXECUTOR
+        self.client.refresh(["c", "d"])
+        self.assertIsNotNone(executor)
+        self.assertIs(jellyfin._REFRESH_EXECUTOR, executor)
+
+    def test_refresh_selected_libraries_failure_exception(self):
+        self.mock_post.side_effect = requests.RequestException("boom")
         ok, message, status = self.client.refresh(["bad"])
         self.assertFalse(ok)
         self.assertEqual(status, 500)
         self.assertIn("bad (error)", message)
 
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.post")
-    def test_refresh_all_success(self, mock_post):
-        mock_post.return_value = _make_response(status_code=204)
+    def test_refresh_selected_libraries_reports_failures_in_order(self):
+        statuses = {
+            "http://jf/Items/a/Refresh": 500,
+            "http://jf/Items/b/Refresh": 204,
+            "http://jf/Items/c/Refresh": 404,
+        }
+        self.mock_post.side_effect = lambda url, **kwargs: _make_response(
+            status_code=statuses[url]
+        )
+        ok, message, status = self.client.refresh(["a", "b", "c"])
+        self.assertFalse(ok)
+        self.assertEqual(status, 500)
+        self.assertEqual(
+            message, "Failed to refresh libraries: a (status 500), c (status 404)"
+        )
+        self.assertEqual(self.mock_post.call_count, 3)
+
+    def test_refresh_library_id_stays_in_one_path_segment(self):
+        self.mock_post.return_value = _NO_CONTENT
+        self.client.refresh(["../System/Restart?x"])
+        self.assertEqual(
+            self.mock_post.call_args.args[0],
+            "http://jf/Items/..%2FSystem%2FRestart%3Fx/Refresh",
+        )
+
+    def test_refresh_all_success(self):
+        self.mock_post.return_value = _NO_CONTENT
         ok, message, status = self.client.refresh()
         self.assertTrue(ok)
         self.assertEqual(status, 200)
         self.assertIn("Triggered Jellyfin refresh", message)
-        mock_post.assert_called_once_with(
+        self.mock_post.assert_called_once_with(
             "http://jf/Library/Refresh",
             headers={"X-Emby-Token": "key"},
             timeout=10,
         )
 
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.post")
-    def test_refresh_all_failure_status(self, mock_post):
-        mock_post.return_value = _make_response(status_code=500)
-        ok, message, status = self.client.refresh()
-        self.assertFalse(ok)
-        self.assertEqual(status, 500)
-        self.assertIn("Failed to trigger Jellyfin", message)
-
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.post")
-    def test_refresh_all_exception(self, mock_post):
-        mock_post.side_effect = requests.RequestException("boom")
-        ok, message, status = self.client.refresh()
-        self.assertFalse(ok)
-        self.assertEqual(status, 502)
-        self.assertIn("Failed to trigger Jellyfin", message)
+    def test_refresh_all_failures(self):
+        cases = [
+            (_make_response(status_code=500), 500),
+            (requests.RequestException("boom"), 502),
+        ]
+        for outcome, expected_status in cases:
+            with self.subTest(outcome=outcome):
+                self._reset()
+                if isinstance(outcome, Exception):
+                    self.mock_post.side_effect = outcome
+                else:
+                    self.mock_post.return_value = outcome
+                ok, message, status = self.client.refresh()
+                self.assertFalse(ok)
+                self.assertEqual(status, expected_status)
+                self.assertIn("Failed to trigger Jellyfin", message)
 
-    @patch("radarr_sonarr_jellyfin_notifier.jellyfin.requests.post")
-    def test_refresh_empty_list_triggers_full_refresh(self, mock_post):
-        mock_post.return_value = _make_response(status_code=204)
+    def test_refresh_empty_list_triggers_full_refresh(self):
+        self.mock_post.return_value = _NO_CONTENT
         ok, message, status = self.client.refresh([])
         self.assertTrue(ok)
         self.assertEqual(status, 200)
-        mock_post.assert_called_once_with(
+        self.mock_post.assert_called_once_with(
             "http://jf/Library/Refresh",
             headers={"X-Emby-Token": "key"},
             timeout=10,
         )
 
 
+class JellyfinSessionTests(unittest.TestCase):
+    def test_hung_server_times_out_without_retrying(self):
+        # Accepts connections but never answers, like a wedged Jellyfin.
+        server = socket.socket()
+        self.addCleanup(server.close)
+        server.bind(("127.0.0.1", 0))
+        server.listen(4)
+        port = server.getsockname()[1]
+        jellyfin._PING_FAILURE_CACHE.clear()
+        self.addCleanup(jellyfin._PING_FAILURE_CACHE.clear)
+
+        client = JellyfinClient(f"http://127.0.0.1:{port}", "key")
+        with patch.object(jellyfin, "_REQUEST_TIMEOUT_SECONDS", 0.2):
+            started = time.monotonic()
+            ok, message, status = client.ping()
+            elapsed = time.monotonic() - started
+
+        self.assertFalse(ok)
+        self.assertEqual(status, 502)
+        self.assertIn("timed out", message)
+        self.assertLess(elapsed, 0.6)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 
 from radarr_sonarr_jellyfin_notifier.jellyfin import (
+    describe_library,
     merge_ids,
     select_library_ids_by_collection,
 )
@@ -28,6 +29,32 @@ class JellyfinUtilsTest(unittest.TestCase):
         self.assertEqual(missing, ["unknown"])
         self.assertEqual(sorted(available), ["movies", "music", "tvshows"])
 
+    def test_select_library_ids_by_collection_matches_case_insensitively(self):
+        folders = [
+            {"Name": "Movies", "ItemId": "1", "CollectionType": "Movies"},
+            {"Name": "4K", "Id": "2", "CollectionType": "movies"},
+        ]
+        selected, missing, available = select_library_ids_by_collection(
+            folders, ["MOVIES"]
+        )
+        self.assertEqual(selected, ["1", "2"])
+        self.assertEqual(missing, [])
+        self.assertEqual(available, ["movies"])
+
+    def test_select_library_ids_by_collection_groups_ids_by_type(self):
+        folders = [
+            {"Name": "Movies", "ItemId": "1", "CollectionType": "movies"},
+            {"Name": "TV", "ItemId": "2", "CollectionType": "tvshows"},
+            {"Name": "4K", "ItemId": "3", "CollectionType": "movies"},
+            {"Name": "Broken", "CollectionType": "music"},
+        ]
+        selected, missing, available = select_library_ids_by_collection(
+            folders, ["tvshows", "movies", "music"]
+        )
+        self.assertEqual(selected, ["1", "3", "2"])
+        self.assertEqual(missing, [])
+        self.assertEqual(available, ["movies", "music", "tvshows"])
+
     def test_select_library_ids_by_collection_ignores_empty_types(self):
         folders = [
             {"Name": "Misc", "ItemId": "1", "CollectionType": ""},
@@ -40,6 +67,37 @@ class JellyfinUtilsTest(unittest.TestCase):
         self.assertEqual(missing, ["movies"])
         self.assertEqual(available, [])
 
+    def test_describe_library(self):
+        folder = {
+            "Name": "Movies",
+            "ItemId": "movie123",
+            "CollectionType": "movies",
+            "Locations": ["/data/movies", ""],
+        }
+        self.assertEqual(
+            describe_library(folder),
+            {
+                "name": "Movies",
+                "itemId": "movie123",
+                "collectionType": "movies",
+                "locations": ["/data/movies"],
+            },
+        )
+
+    def test_describe_library_uses_path_infos_when_locations_missing(self):
+        folder = {
+            "Name": "Movies",
+            "ItemId": "movie123",
+            "CollectionType": "movies",
+            "Locations": [],
+            "LibraryOptions": {"PathInfos": [{"Path": "/data/movies"}]},
+        }
+        self.assertEqual(describe_library(folder)["locations"], ["/data/movies"])
+
+    def test_describe_library_uses_id_when_itemid_missing(self):
+        folder = {"Name": "Movies", "Id": "movie123", "CollectionType": "movies"}
+        self.assertEqual(describe_library(folder)["itemId"], "movie123")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -5,23 +5,31 @@ from radarr_sonarr_jellyfin_notifier.logging_setup import HealthLogFilter
 
 
 class LoggingSetupTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The filter only reads record.args, which every test sets itself.
+        cls.filt = HealthLogFilter()
+        cls.record = logging.LogRecord("werkzeug", logging.INFO, "", 0, "", (), None)
+
     def test_health_log_filter_blocks_health(self):
-        filt = HealthLogFilter()
-        record = logging.LogRecord("werkzeug", logging.INFO, "", 0, "", (), None)
-        record.args = ("GET /health HTTP/1.1",)
-        self.assertFalse(filt.filter(record))
+        self.record.args = ("GET /health HTTP/1.1",)
+        self.assertFalse(self.filt.filter(self.record))
 
     def test_health_log_filter_allows_other_paths(self):
-        filt = HealthLogFilter()
-        record = logging.LogRecord("werkzeug", logging.INFO, "", 0, "", (), None)
-        record.args = ("GET /radarr-webhook HTTP/1.1",)
-        self.assertTrue(filt.filter(record))
+        self.record.args = ("GET /radarr-webhook HTTP/1.1",)
+        self.assertTrue(self.filt.filter(self.record))
 
     def test_health_log_filter_allows_empty_args(self):
-        filt = HealthLogFilter()
-        record = logging.LogRecord("werkzeug", logging.INFO, "", 0, "", (), None)
-        record.args = ()
-        self.assertTrue(filt.filter(record))
+        self.record.args = ()
+        self.assertTrue(self.filt.filter(self.record))
+
+    def test_health_log_filter_blocks_health_with_query(self):
+        self.record.args = ("GET /health?probe=1 HTTP/1.1",)
+        self.assertFalse(self.filt.filter(self.record))
+
+    def test_health_log_filter_allows_non_string_args(self):
+        self.record.args = (404, "/health")
+        self.assertTrue(self.filt.filter(self.record))
 
 
 if __name__ == "__main__":
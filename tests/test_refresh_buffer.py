@@ -1,91 +1,195 @@
-import os
 import threading
 import unittest
 from types import SimpleNamespace
-from unittest.mock import Mock, patch
+from unittest.mock import Mock, call, patch
 
 import radarr_sonarr_jellyfin_notifier.webhooks as webhooks
 
 
 class RefreshBufferTests(unittest.TestCase):
     def setUp(self):
-        self.env_patcher = patch.dict(
-            os.environ,
-            {
-                "JELLYFIN_NOTIFIER_REFRESH_DEBOUNCE_SECONDS": "1",
-                "JELLYFIN_NOTIFIER_REFRESH_MAX_WAIT_SECONDS": "2",
-            },
-            clear=False,
-        )
-        self.env_patcher.start()
+        self._use_delays(1, 2)
         with webhooks._REFRESH_COND:
             webhooks._REFRESH_QUEUE.clear()
+            webhooks._REFRESH_HEAP.clear()
+        webhooks._CLIENTS.clear()
 
     def tearDown(self):
-        self.env_patcher.stop()
         with webhooks._REFRESH_COND:
             webhooks._REFRESH_QUEUE.clear()
+            webhooks._REFRESH_HEAP.clear()
+        webhooks._CLIENTS.clear()
+
+    def _use_delays(self, debounce_seconds, max_wait_seconds):
+        # Patch the getters rather than os.environ: no env parsing per test,
+        # and timing tests can use sub-second windows.
+        patcher = patch.multiple(
+            webhooks,
+            _get_refresh_debounce_seconds=Mock(return_value=debounce_seconds),
+            _get_refresh_max_wait_seconds=Mock(return_value=max_wait_seconds),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _fake_clock(self, now):
+        # Holding the condition keeps the background worker out while the
+        # test drains the queue inline against the fake clock.
+        webhooks._REFRESH_COND.acquire()
+        self.addCleanup(webhooks._REFRESH_COND.release)
+        patcher = patch.object(webhooks, "_clock", return_value=now)
+        clock = patcher.start()
+        self.addCleanup(patcher.stop)
+        return clock
 
     @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
     def test_buffer_coalesces_requests(self, mock_client_cls):
-        done = threading.Event()
-        calls = []
-
-        def refresh(library_ids=None):
-            calls.append(library_ids)
-            done.set()
-            return True, "ok", 200
-
-        mock_client_cls.return_value = SimpleNamespace(refresh=Mock(side_effect=refresh))
+        refresh = Mock(return_value=(True, "ok", 200))
+        mock_client_cls.return_value = SimpleNamespace(refresh=refresh)
+        clock = self._fake_clock(100.0)
 
         result1 = webhooks._enqueue_refresh_request("http://jf", "key", ["a"])
         result2 = webhooks._enqueue_refresh_request("http://jf", "key", ["b", "a"])
+        clock.return_value = 100.5
+        webhooks._drain_due_refreshes()
+        refresh.assert_not_called()
+        clock.return_value = 101.0
+        webhooks._drain_due_refreshes()
 
         self.assertEqual(result1[2], 202)
         self.assertEqual(result2[2], 202)
-        self.assertTrue(done.wait(timeout=2))
-        self.assertEqual(len(calls), 1)
-        self.assertEqual(calls[0], ["a", "b"])
+        refresh.assert_called_once_with(library_ids=["a", "b"])
 
     @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
     def test_buffer_all_overrides_ids(self, mock_client_cls):
-        done = threading.Event()
-        calls = []
-
-        def refresh(library_ids=None):
-            calls.append(library_ids)
-            done.set()
-            return True, "ok", 200
-
-        mock_client_cls.return_value = SimpleNamespace(refresh=Mock(side_effect=refresh))
+        refresh = Mock(return_value=(True, "ok", 200))
+        mock_client_cls.return_value = SimpleNamespace(refresh=refresh)
+        clock = self._fake_clock(100.0)
 
         webhooks._enqueue_refresh_request("http://jf", "key", ["a"])
         webhooks._enqueue_refresh_request("http://jf", "key", None)
+        clock.return_value = 101.0
+        webhooks._drain_due_refreshes()
 
-        self.assertTrue(done.wait(timeout=2))
-        self.assertEqual(calls, [None])
+        refresh.assert_called_once_with(library_ids=None)
 
     @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
     def test_buffer_max_wait_caps_delay(self, mock_client_cls):
+        refresh = Mock(return_value=(True, "ok", 200))
+        mock_client_cls.return_value = SimpleNamespace(refresh=refresh)
+        self._use_delays(5, 1)
+        clock = self._fake_clock(100.0)
+
+        webhooks._enqueue_refresh_request("http://jf", "key", ["a"])
+        clock.return_value = 100.5
+        webhooks._enqueue_refresh_request("http://jf", "key", ["b"])
+        clock.return_value = 100.9
+        webhooks._drain_due_refreshes()
+        refresh.assert_not_called()
+        clock.return_value = 101.0
+        webhooks._drain_due_refreshes()
+
+        refresh.assert_called_once_with(library_ids=["a", "b"])
+
+    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
+    def test_drain_waits_until_bucket_is_due(self, mock_client_cls):
+        refresh = Mock(return_value=(True, "ok", 200))
+        mock_client_cls.return_value = SimpleNamespace(refresh=refresh)
+        clock = self._fake_clock(100.0)
+        webhooks._enqueue_refresh_request("http://jf", "key", ["a"])
+
+        def advance(timeout=None):
+            refresh.assert_not_called()
+            clock.return_value += timeout
+
+        with patch.object(webhooks._REFRESH_COND, "wait", side_effect=advance) as wait:
+            webhooks._drain_due_refreshes(wait=True)
+
+        wait.assert_called_once_with(timeout=1.0)
+        refresh.assert_called_once_with(library_ids=["a"])
+
+    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
+    def test_worker_runs_due_refresh(self, mock_client_cls):
         done = threading.Event()
 
         def refresh(library_ids=None):
             done.set()
             return True, "ok", 200
 
-        mock_client_cls.return_value = SimpleNamespace(refresh=Mock(side_effect=refresh))
+        mock_client_cls.return_value = SimpleNamespace(refresh=refresh)
+        self._use_delays(0.05, 0.1)
 
-        with patch.dict(
-            os.environ,
-            {
-                "JELLYFIN_NOTIFIER_REFRESH_DEBOUNCE_SECONDS": "5",
-                "JELLYFIN_NOTIFIER_REFRESH_MAX_WAIT_SECONDS": "1",
-            },
-        ):
-            webhooks._enqueue_refresh_request("http://jf", "key", ["a"])
+        webhooks._enqueue_refresh_request("http://jf", "key", ["a"])
 
         self.assertTrue(done.wait(timeout=2))
 
+    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
+    def test_immediate_refresh_reuses_in_flight_result(self, mock_client_cls):
+        refresh = Mock(return_value=(True, "ok", 200))
+        mock_client_cls.return_value = SimpleNamespace(refresh=refresh)
+        inflight = webhooks.InflightRefresh(result=(True, "shared", 200))
+        inflight.done.set()
+        key = ("http://jf", "key", frozenset(["a", "b"]))
+
+        self._use_delays(0, 2)
+        with patch.dict(webhooks._INFLIGHT_REFRESHES, {key: inflight}):
+            result = webhooks._enqueue_refresh_request("http://jf", "key", ["b", "a"])
+
+        self.assertEqual(result, (True, "shared", 200))
+        refresh.assert_not_called()
+
+    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
+    def test_immediate_refresh_clears_in_flight_entry(self, mock_client_cls):
+        refresh = Mock(return_value=(False, "boom", 500))
+        mock_client_cls.return_value = SimpleNamespace(refresh=refresh)
+
+        self._use_delays(0, 2)
+        result = webhooks._enqueue_refresh_request("http://jf", "key", None)
+
+        self.assertEqual(result, (False, "boom", 500))
+        refresh.assert_called_once_with(library_ids=None)
+        self.assertEqual(webhooks._INFLIGHT_REFRESHES, {})
+
+    def test_get_client_reuses_instance_per_credentials(self):
+        first = webhooks._get_client("http://jf", "key")
+        self.assertIs(webhooks._get_client("http://jf", "key"), first)
+        self.assertIsNot(webhooks._get_client("http://jf", "other"), first)
+
+    def test_next_due_bucket_skips_stale_heap_entries(self):
+        key = ("http://jf", "key")
+        bucket = webhooks.RefreshBucket(next_run=20.0)
+        with webhooks._REFRESH_COND, patch.dict(
+            webhooks._REFRESH_QUEUE, {key: bucket}
+        ), patch.object(
+            webhooks,
+            "_REFRESH_HEAP",
+            [(5.0, ("http://gone", "key")), (10.0, key), (20.0, key)],
+        ):
+            self.assertEqual(webhooks._get_next_due_bucket(), (key, bucket, 20.0))
+            self.assertEqual(webhooks._REFRESH_HEAP, [(20.0, key)])
+
+    def test_rejected_key_is_not_retried_with_another_buckets_key(self):
+        clients = {
+            "bad": Mock(**{"refresh.return_value": (False, "rejected", 401)}),
+            "good": Mock(**{"refresh.return_value": (True, "ok", 200)}),
+        }
+        due = [
+            (("http://jf", "bad"), webhooks.RefreshBucket(pending_ids=["1"])),
+            (("http://jf", "good"), webhooks.RefreshBucket(pending_ids=["2"])),
+            (("http://other", "good"), webhooks.RefreshBucket(pending_all=True)),
+        ]
+        get_client = Mock(side_effect=lambda url, key: clients[key])
+        with patch.object(webhooks, "_get_client", get_client):
+            webhooks._run_refreshes(due)
+
+        self.assertEqual(
+            [c.args for c in get_client.call_args_list],
+            [("http://jf", "bad"), ("http://jf", "good"), ("http://other", "good")],
+        )
+        clients["bad"].refresh.assert_called_once_with(library_ids=["1"])
+        self.assertEqual(
+            clients["good"].refresh.call_args_list,
+            [call(library_ids=["2"]), call(library_ids=None)],
+        )
 
 if __name__ == "__main__":
     unittest.main()
@@ -9,9 +9,17 @@ from radarr_sonarr_jellyfin_notifier.main import create_app
 
 
 class WebhookTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The app holds no per-test state, so build it and its URL map once.
+        cls.app = create_app()
+        cls.client = cls.app.test_client()
+        client_patcher = patch.object(webhooks, "JellyfinClient", new_callable=Mock)
+        cls.mock_client_cls = client_patcher.start()
+        cls.addClassCleanup(client_patcher.stop)
+
     def setUp(self):
-        self.app = create_app()
-        self.client = self.app.test_client()
+        self.mock_client_cls.reset_mock(return_value=True, side_effect=True)
         self.env_patcher = patch.dict(
             os.environ,
             {
@@ -28,21 +36,25 @@ class WebhookTests(unittest.TestCase):
         webhooks._RATE_LIMIT_STATE.clear()
         with webhooks._REFRESH_COND:
             webhooks._REFRESH_QUEUE.clear()
+            webhooks._REFRESH_HEAP.clear()
+        webhooks._CLIENTS.clear()
 
     def tearDown(self):
         self.env_patcher.stop()
         webhooks._RATE_LIMIT_STATE.clear()
         with webhooks._REFRESH_COND:
             webhooks._REFRESH_QUEUE.clear()
+            webhooks._REFRESH_HEAP.clear()
+        webhooks._CLIENTS.clear()
 
     def test_health_endpoint_ok(self):
         resp = self.client.get("/health")
         self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "application/json")
         data = json.loads(resp.get_data(as_text=True))
         self.assertEqual(data["status"], "ok")
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_radarr_refresh_merges_ids_and_collection_types(self, mock_client_cls):
+    def test_radarr_refresh_merges_ids_and_collection_types(self):
         fake_client = SimpleNamespace(
             fetch_virtual_folders=lambda: (
                 True,
@@ -51,7 +63,7 @@ class WebhookTests(unittest.TestCase):
                 [{"Name": "Movies", "ItemId": "movie123", "CollectionType": "movies"}],
             ),
         )
-        mock_client_cls.return_value = fake_client
+        self.mock_client_cls.return_value = fake_client
 
         with patch("radarr_sonarr_jellyfin_notifier.webhooks._enqueue_refresh_request") as mock_enqueue:
             mock_enqueue.return_value = (True, "queued", 202)
@@ -71,8 +83,7 @@ class WebhookTests(unittest.TestCase):
             "http://jf", "key", ["libA", "libB", "movie123"]
         )
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_radarr_unknown_collection_type_returns_400(self, mock_client_cls):
+    def test_radarr_unknown_collection_type_returns_400(self):
         fake_client = SimpleNamespace(
             fetch_virtual_folders=lambda: (
                 True,
@@ -81,7 +92,7 @@ class WebhookTests(unittest.TestCase):
                 [{"Name": "Movies", "ItemId": "movie123", "CollectionType": "movies"}],
             )
         )
-        mock_client_cls.return_value = fake_client
+        self.mock_client_cls.return_value = fake_client
 
         resp = self.client.post(
             "/radarr-webhook",
@@ -96,16 +107,14 @@ class WebhookTests(unittest.TestCase):
         self.assertEqual(resp.status_code, 400)
         self.assertIn("Unknown collection types", resp.get_data(as_text=True))
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_radarr_missing_headers_returns_400(self, mock_client_cls):
+    def test_radarr_missing_headers_returns_400(self):
         resp = self.client.post("/radarr-webhook", json={"eventType": "Download"})
         self.assertEqual(resp.status_code, 400)
         self.assertIn("Missing credentials", resp.get_data(as_text=True))
-        mock_client_cls.assert_not_called()
+        self.mock_client_cls.assert_not_called()
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_radarr_uses_env_credentials_when_headers_missing(self, mock_client_cls):
-        mock_client_cls.return_value = SimpleNamespace()
+    def test_radarr_uses_env_credentials_when_headers_missing(self):
+        self.mock_client_cls.return_value = SimpleNamespace()
 
         with patch("radarr_sonarr_jellyfin_notifier.webhooks._enqueue_refresh_request") as mock_enqueue:
             mock_enqueue.return_value = (True, "queued", 202)
@@ -118,11 +127,28 @@ class WebhookTests(unittest.TestCase):
                 )
 
         self.assertEqual(resp.status_code, 202)
-        mock_client_cls.assert_called_once_with("http://jf", "key")
+        self.mock_client_cls.assert_called_once_with("http://jf", "key")
         mock_enqueue.assert_called_once_with("http://jf", "key", None)
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_allowlist_blocks_request(self, mock_client_cls):
+    def test_radarr_non_object_payload_is_ignored(self):
+        self.mock_client_cls.return_value = SimpleNamespace()
+        headers = {"X-Jellyfin-Url": "http://jf", "X-Jellyfin-Api-Key": "key"}
+
+        for name, body in (
+            ("array", {"json": ["not", "an", "object"]}),
+            ("malformed", {"data": "{", "content_type": "application/json"}),
+            ("text", {"data": '{"eventType": "Test"}', "content_type": "text/plain"}),
+        ):
+            with self.subTest(name), patch(
+                "radarr_sonarr_jellyfin_notifier.webhooks._enqueue_refresh_request"
+            ) as mock_enqueue:
+                mock_enqueue.return_value = (True, "queued", 202)
+                resp = self.client.post("/radarr-webhook", headers=headers, **body)
+
+                self.assertEqual(resp.status_code, 202)
+                mock_enqueue.assert_called_once_with("http://jf", "key", None)
+
+    def test_allowlist_blocks_request(self):
         with patch.dict(os.environ, {"JELLYFIN_NOTIFIER_ALLOWLIST": "10.0.0.1"}):
             resp = self.client.post(
                 "/radarr-webhook",
@@ -134,10 +160,9 @@ class WebhookTests(unittest.TestCase):
             )
 
         self.assertEqual(resp.status_code, 403)
-        mock_client_cls.assert_not_called()
+        self.mock_client_cls.assert_not_called()
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_allowlist_invalid_entry_returns_500(self, mock_client_cls):
+    def test_allowlist_invalid_entry_returns_500(self):
         with patch.dict(os.environ, {"JELLYFIN_NOTIFIER_ALLOWLIST": "nope"}):
             resp = self.client.post(
                 "/radarr-webhook",
@@ -150,11 +175,10 @@ class WebhookTests(unittest.TestCase):
 
         self.assertEqual(resp.status_code, 500)
         self.assertIn("Invalid allowlist entry", resp.get_data(as_text=True))
-        mock_client_cls.assert_not_called()
+        self.mock_client_cls.assert_not_called()
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_allowlist_allows_request(self, mock_client_cls):
-        mock_client_cls.return_value = SimpleNamespace()
+    def test_allowlist_allows_request(self):
+        self.mock_client_cls.return_value = SimpleNamespace()
 
         with patch("radarr_sonarr_jellyfin_notifier.webhooks._enqueue_refresh_request") as mock_enqueue:
             mock_enqueue.return_value = (True, "queued", 202)
@@ -173,9 +197,8 @@ class WebhookTests(unittest.TestCase):
         self.assertEqual(resp.status_code, 202)
         mock_enqueue.assert_called_once_with("http://jf", "key", None)
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_rate_limit_exceeded_returns_429(self, mock_client_cls):
-        mock_client_cls.return_value = SimpleNamespace()
+    def test_rate_limit_exceeded_returns_429(self):
+        self.mock_client_cls.return_value = SimpleNamespace()
 
         with patch("radarr_sonarr_jellyfin_notifier.webhooks._enqueue_refresh_request") as mock_enqueue:
             mock_enqueue.return_value = (True, "queued", 202)
@@ -204,14 +227,13 @@ class WebhookTests(unittest.TestCase):
         self.assertEqual(resp2.headers.get("Retry-After"), "60")
         self.assertEqual(mock_enqueue.call_count, 1)
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_radarr_test_event_does_not_refresh(self, mock_client_cls):
+    def test_radarr_test_event_does_not_refresh(self):
         fake_client = SimpleNamespace(
             ping=Mock(return_value=(True, "ping ok", 200)),
             fetch_virtual_folders=Mock(return_value=(True, "vf ok", 200, [])),
             refresh=Mock(return_value=(True, "refresh", 200)),
         )
-        mock_client_cls.return_value = fake_client
+        self.mock_client_cls.return_value = fake_client
 
         with patch("radarr_sonarr_jellyfin_notifier.webhooks._enqueue_refresh_request") as mock_enqueue:
             resp = self.client.post(
@@ -228,14 +250,38 @@ class WebhookTests(unittest.TestCase):
         fake_client.refresh.assert_not_called()
         mock_enqueue.assert_not_called()
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_radarr_collection_types_fetch_folders_error(self, mock_client_cls):
+    def test_radarr_test_event_resolves_collection_types_from_one_fetch(self):
+        folders = [{"Name": "Movies", "ItemId": "movie123", "CollectionType": "movies"}]
+        fake_client = SimpleNamespace(
+            ping=Mock(return_value=(True, "ping ok", 200)),
+            fetch_virtual_folders=Mock(return_value=(True, "vf ok", 200, folders)),
+        )
+        self.mock_client_cls.return_value = fake_client
+        headers = {"X-Jellyfin-Url": "http://jf", "X-Jellyfin-Api-Key": "key"}
+
+        resp = self.client.post(
+            "/radarr-webhook",
+            json={"eventType": "Test"},
+            headers={**headers, "X-Jellyfin-Collection-Types": "movies"},
+        )
+        self.assertEqual(resp.status_code, 200)
+        fake_client.fetch_virtual_folders.assert_called_once_with()
+
+        resp = self.client.post(
+            "/radarr-webhook",
+            json={"eventType": "Test"},
+            headers={**headers, "X-Jellyfin-Collection-Types": "music"},
+        )
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("Unknown collection types: music", resp.get_data(as_text=True))
+
+    def test_radarr_collection_types_fetch_folders_error(self):
         refresh = Mock(return_value=(True, "refresh", 200))
         fake_client = SimpleNamespace(
             fetch_virtual_folders=Mock(return_value=(False, "vf error", 502, None)),
             refresh=refresh,
         )
-        mock_client_cls.return_value = fake_client
+        self.mock_client_cls.return_value = fake_client
 
         resp = self.client.post(
             "/radarr-webhook",
@@ -251,10 +297,7 @@ class WebhookTests(unittest.TestCase):
         self.assertIn("vf error", resp.get_data(as_text=True))
         refresh.assert_not_called()
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_radarr_collection_types_no_matching_ids_returns_400(
-        self, mock_client_cls
-    ):
+    def test_radarr_collection_types_no_matching_ids_returns_400(self):
         refresh = Mock(return_value=(True, "refresh", 200))
         fake_client = SimpleNamespace(
             fetch_virtual_folders=Mock(
@@ -267,7 +310,7 @@ class WebhookTests(unittest.TestCase):
             ),
             refresh=refresh,
         )
-        mock_client_cls.return_value = fake_client
+        self.mock_client_cls.return_value = fake_client
 
         resp = self.client.post(
             "/radarr-webhook",
@@ -283,9 +326,8 @@ class WebhookTests(unittest.TestCase):
         self.assertIn("No libraries matched collection types", resp.get_data(as_text=True))
         refresh.assert_not_called()
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_radarr_refresh_when_no_targets_refreshes_all(self, mock_client_cls):
-        mock_client_cls.return_value = SimpleNamespace()
+    def test_radarr_refresh_when_no_targets_refreshes_all(self):
+        self.mock_client_cls.return_value = SimpleNamespace()
 
         with patch("radarr_sonarr_jellyfin_notifier.webhooks._enqueue_refresh_request") as mock_enqueue:
             mock_enqueue.return_value = (True, "queued", 202)
@@ -301,8 +343,7 @@ class WebhookTests(unittest.TestCase):
         self.assertEqual(resp.status_code, 202)
         mock_enqueue.assert_called_once_with("http://jf", "key", None)
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_sonarr_unknown_collection_type_returns_400(self, mock_client_cls):
+    def test_sonarr_unknown_collection_type_returns_400(self):
         fake_client = SimpleNamespace(
             fetch_virtual_folders=lambda: (
                 True,
@@ -311,7 +352,7 @@ class WebhookTests(unittest.TestCase):
                 [{"Name": "TV", "ItemId": "tv123", "CollectionType": "tvshows"}],
             )
         )
-        mock_client_cls.return_value = fake_client
+        self.mock_client_cls.return_value = fake_client
 
         resp = self.client.post(
             "/sonarr-webhook",
@@ -326,8 +367,7 @@ class WebhookTests(unittest.TestCase):
         self.assertEqual(resp.status_code, 400)
         self.assertIn("Unknown collection types", resp.get_data(as_text=True))
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_sonarr_refresh_merges_ids_and_collection_types(self, mock_client_cls):
+    def test_sonarr_refresh_merges_ids_and_collection_types(self):
         fake_client = SimpleNamespace(
             fetch_virtual_folders=lambda: (
                 True,
@@ -336,7 +376,7 @@ class WebhookTests(unittest.TestCase):
                 [{"Name": "TV", "ItemId": "tv123", "CollectionType": "tvshows"}],
             )
         )
-        mock_client_cls.return_value = fake_client
+        self.mock_client_cls.return_value = fake_client
 
         with patch("radarr_sonarr_jellyfin_notifier.webhooks._enqueue_refresh_request") as mock_enqueue:
             mock_enqueue.return_value = (True, "queued", 202)
@@ -354,21 +394,19 @@ class WebhookTests(unittest.TestCase):
         self.assertEqual(resp.status_code, 202)
         mock_enqueue.assert_called_once_with("http://jf", "key", ["libA", "tv123"])
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_sonarr_missing_headers_returns_400(self, mock_client_cls):
+    def test_sonarr_missing_headers_returns_400(self):
         resp = self.client.post("/sonarr-webhook", json={"eventType": "Download"})
         self.assertEqual(resp.status_code, 400)
         self.assertIn("Missing credentials", resp.get_data(as_text=True))
-        mock_client_cls.assert_not_called()
+        self.mock_client_cls.assert_not_called()
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_sonarr_test_event_ping_failure(self, mock_client_cls):
+    def test_sonarr_test_event_ping_failure(self):
         fake_client = SimpleNamespace(
             ping=Mock(return_value=(False, "ping failed", 502)),
             fetch_virtual_folders=Mock(return_value=(True, "vf ok", 200, [])),
             refresh=Mock(return_value=(True, "refresh", 200)),
         )
-        mock_client_cls.return_value = fake_client
+        self.mock_client_cls.return_value = fake_client
 
         with patch("radarr_sonarr_jellyfin_notifier.webhooks._enqueue_refresh_request") as mock_enqueue:
             resp = self.client.post(
@@ -386,18 +424,15 @@ class WebhookTests(unittest.TestCase):
         fake_client.refresh.assert_not_called()
         mock_enqueue.assert_not_called()
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_libraries_endpoint_requires_credentials(self, mock_client_cls):
+    def test_libraries_endpoint_requires_credentials(self):
         resp = self.client.get("/libraries")
         self.assertEqual(resp.status_code, 400)
-        mock_client_cls.assert_not_called()
+        self.assertIn("url query param", resp.get_data(as_text=True))
+        self.mock_client_cls.assert_not_called()
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_libraries_endpoint_uses_env_credentials(self, mock_client_cls):
-        fake_client = SimpleNamespace(
-            fetch_virtual_folders=lambda: (True, "ok", 200, [])
-        )
-        mock_client_cls.return_value = fake_client
+    def test_libraries_endpoint_uses_env_credentials(self):
+        fake_client = SimpleNamespace(fetch_libraries=lambda: (True, "ok", 200, []))
+        self.mock_client_cls.return_value = fake_client
 
         with patch.dict(
             os.environ, {"JELLYFIN_URL": "http://jf", "JELLYFIN_API_KEY": "key"}
@@ -405,37 +440,52 @@ class WebhookTests(unittest.TestCase):
             resp = self.client.get("/libraries")
 
         self.assertEqual(resp.status_code, 200)
-        mock_client_cls.assert_called_once_with("http://jf", "key")
+        self.mock_client_cls.assert_called_once_with("http://jf", "key")
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_libraries_endpoint_propagates_fetch_error(self, mock_client_cls):
+    def test_libraries_endpoint_propagates_fetch_error(self):
         fake_client = SimpleNamespace(
-            fetch_virtual_folders=lambda: (False, "nope", 401, None)
+            fetch_libraries=lambda: (False, "nope", 401, None)
         )
-        mock_client_cls.return_value = fake_client
+        self.mock_client_cls.return_value = fake_client
 
         resp = self.client.get("/libraries?url=http://jf&api_key=key")
         self.assertEqual(resp.status_code, 401)
         self.assertIn("nope", resp.get_data(as_text=True))
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_libraries_endpoint_returns_payload(self, mock_client_cls):
+    def test_libraries_endpoint_indents_only_for_readers(self):
+        fake_client = SimpleNamespace(fetch_libraries=lambda: (True, "ok", 200, []))
+        self.mock_client_cls.return_value = fake_client
+        url = "/libraries?url=http://jf&api_key=key"
+
+        for accept in ("application/json", "*/*", "text/html,application/json"):
+            with self.subTest(accept=accept):
+                resp = self.client.get(url, headers={"Accept": accept})
+                self.assertEqual(resp.get_data(as_text=True), '{"libraries":[]}')
+                self.assertIn("Accept", resp.vary)
+        resp = self.client.get(url, headers={"Accept": "text/html,*/*;q=0.8"})
+        self.assertEqual(resp.get_data(as_text=True), '{\n  "libraries": []\n}')
+        resp = self.client.get(
+            url + "&pretty=1", headers={"Accept": "application/json"}
+        )
+        self.assertIn("\n", resp.get_data(as_text=True))
+
+    def test_libraries_endpoint_returns_payload(self):
         fake_client = SimpleNamespace(
-            fetch_virtual_folders=lambda: (
+            fetch_libraries=lambda: (
                 True,
                 "ok",
                 200,
                 [
                     {
-                        "Name": "Movies",
-                        "ItemId": "movie123",
-                        "CollectionType": "movies",
-                        "Locations": ["/data/movies"],
+                        "name": "Movies",
+                        "itemId": "movie123",
+                        "collectionType": "movies",
+                        "locations": ["/data/movies"],
                     }
                 ],
             )
         )
-        mock_client_cls.return_value = fake_client
+        self.mock_client_cls.return_value = fake_client
 
         resp = self.client.get(
             "/libraries?url=http://jf&api_key=key",
@@ -449,76 +499,81 @@ class WebhookTests(unittest.TestCase):
         self.assertEqual(lib["collectionType"], "movies")
         self.assertEqual(lib["locations"], ["/data/movies"])
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_libraries_endpoint_uses_headers(self, mock_client_cls):
-        fake_client = SimpleNamespace(
-            fetch_virtual_folders=lambda: (
-                True,
-                "ok",
-                200,
-                [
-                    {
-                        "Name": "Movies",
-                        "ItemId": "movie123",
-                        "CollectionType": "movies",
-                        "Locations": ["/data/movies"],
-                    }
-                ],
-            )
+    def test_libraries_endpoint_filters_by_collection_type(self):
+        libraries = [
+            {"name": "Movies", "itemId": "1", "collectionType": "movies"},
+            {"name": "Misc", "itemId": "2", "collectionType": None},
+            {"name": "TV", "itemId": "3", "collectionType": "tvshows"},
+        ]
+        self.mock_client_cls.return_value = SimpleNamespace(
+            fetch_libraries=lambda: (True, "ok", 200, libraries)
         )
-        mock_client_cls.return_value = fake_client
 
         resp = self.client.get(
-            "/libraries",
-            headers={"X-Jellyfin-Url": "http://jf", "X-Jellyfin-Api-Key": "key"},
+            "/libraries?url=http://jf&api_key=key&collection_type=TVShows, movies"
         )
         self.assertEqual(resp.status_code, 200)
+        data = json.loads(resp.get_data(as_text=True))
+        self.assertEqual([lib["itemId"] for lib in data["libraries"]], ["1", "3"])
+
+    def test_libraries_endpoint_honours_if_none_match(self):
+        libraries = [{"name": "Movies", "itemId": "1", "collectionType": "movies"}]
+        self.mock_client_cls.return_value = SimpleNamespace(
+            fetch_libraries=lambda: (True, "ok", 200, libraries)
+        )
+        url = "/libraries?url=http://jf&api_key=key"
+
+        first = self.client.get(url)
+        etag = first.headers["ETag"]
+        second = self.client.get(url, headers={"If-None-Match": etag})
+        libraries.append({"name": "TV", "itemId": "2", "collectionType": "tvshows"})
+        third = self.client.get(url, headers={"If-None-Match": etag})
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.get_data(), b"")
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third.headers["ETag"], etag)
+
+    def test_libraries_endpoint_etag_ignores_indentation(self):
+        self.mock_client_cls.return_value = SimpleNamespace(
+            fetch_libraries=lambda: (True, "ok", 200, [])
+        )
+        url = "/libraries?url=http://jf&api_key=key"
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_libraries_endpoint_uses_path_infos_when_locations_missing(
-        self, mock_client_cls
-    ):
+        compact = self.client.get(url, headers={"Accept": "application/json"})
+        pretty = self.client.get(
+            url,
+            headers={"Accept": "text/html", "If-None-Match": compact.headers["ETag"]},
+        )
+
+        self.assertEqual(pretty.status_code, 304)
+        self.assertEqual(pretty.headers["ETag"], compact.headers["ETag"])
+        self.assertIn("Accept", pretty.vary)
+
+    def test_libraries_endpoint_uses_headers(self):
         fake_client = SimpleNamespace(
-            fetch_virtual_folders=lambda: (
+            fetch_libraries=lambda: (
                 True,
                 "ok",
                 200,
                 [
                     {
-                        "Name": "Movies",
-                        "ItemId": "movie123",
-                        "CollectionType": "movies",
-                        "Locations": [],
-                        "LibraryOptions": {"PathInfos": [{"Path": "/data/movies"}]},
+                        "name": "Movies",
+                        "itemId": "movie123",
+                        "collectionType": "movies",
+                        "locations": ["/data/movies"],
                     }
                 ],
             )
         )
-        mock_client_cls.return_value = fake_client
-
-        resp = self.client.get("/libraries?url=http://jf&api_key=key")
-        self.assertEqual(resp.status_code, 200)
-        data = json.loads(resp.get_data(as_text=True))
-        lib = data["libraries"][0]
-        self.assertEqual(lib["locations"], ["/data/movies"])
+        self.mock_client_cls.return_value = fake_client
 
-    @patch("radarr_sonarr_jellyfin_notifier.webhooks.JellyfinClient")
-    def test_libraries_endpoint_uses_id_when_itemid_missing(self, mock_client_cls):
-        fake_client = SimpleNamespace(
-            fetch_virtual_folders=lambda: (
-                True,
-                "ok",
-                200,
-                [{"Name": "Movies", "Id": "movie123", "CollectionType": "movies"}],
-            )
+        resp = self.client.get(
+            "/libraries",
+            headers={"X-Jellyfin-Url": "http://jf", "X-Jellyfin-Api-Key": "key"},
         )
-        mock_client_cls.return_value = fake_client
-
-        resp = self.client.get("/libraries?url=http://jf&api_key=key")
         self.assertEqual(resp.status_code, 200)
-        data = json.loads(resp.get_data(as_text=True))
-        lib = data["libraries"][0]
-        self.assertEqual(lib["itemId"], "movie123")
 
 
 if __name__ == "__main__":
@@ -1,7 +1,18 @@
+import ipaddress
+import logging
+import time
 import unittest
 from types import SimpleNamespace
+from unittest.mock import patch
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import radarr_sonarr_jellyfin_notifier.webhooks as webhooks
 from radarr_sonarr_jellyfin_notifier.webhooks import (
+    _parse_allowlist_value,
     is_test_event,
     parse_collection_types_header,
     parse_library_ids_header,
@@ -12,6 +23,8 @@ class WebhookUtilsTests(unittest.TestCase):
     def test_is_test_event_case_insensitive(self):
         self.assertTrue(is_test_event("Test"))
         self.assertTrue(is_test_event("test"))
+        self.assertTrue(is_test_event("tEsT"))
+        self.assertFalse(is_test_event("Tests"))
         self.assertFalse(is_test_event("Download"))
         self.assertFalse(is_test_event(123))
 
@@ -19,12 +32,168 @@ class WebhookUtilsTests(unittest.TestCase):
         req = SimpleNamespace(headers={"X-Jellyfin-Library-Ids": " a, b ,, c "})
         self.assertEqual(parse_library_ids_header(req), ["a", "b", "c"])
 
+    def test_parse_library_ids_header_missing(self):
+        req = SimpleNamespace(headers={})
+        self.assertEqual(parse_library_ids_header(req), [])
+
     def test_parse_collection_types_header(self):
         req = SimpleNamespace(
             headers={"X-Jellyfin-Collection-Types": " Movies, TVShows , ,"}
         )
         self.assertEqual(parse_collection_types_header(req), ["movies", "tvshows"])
 
+    def test_parse_collection_types_header_missing(self):
+        req = SimpleNamespace(headers={})
+        self.assertEqual(parse_collection_types_header(req), [])
+
+    def test_split_library_ids(self):
+        self.assertEqual(webhooks._split_library_ids(" a, b ,, c "), ("a", "b", "c"))
+        self.assertEqual(webhooks._split_library_ids(None), ())
+
+    def test_split_collection_types(self):
+        self.assertEqual(
+            webhooks._split_collection_types(" Movies, TVShows , ,"),
+            ("movies", "tvshows"),
+        )
+        self.assertEqual(webhooks._split_collection_types(None), ())
+
+    def test_parse_allowlist_value_is_cached(self):
+        raw = "10.0.0.0/8, 127.0.0.1, 10.1.0.0/16, ::1, 192.0.0.0/7"
+        index, error = _parse_allowlist_value(raw)
+        self.assertIsNone(error)
+        self.assertEqual(
+            dict(index),
+            {
+                4: (
+                    (0x0A000000, 0x7F000001, 0xC0000000),
+                    (0x0AFFFFFF, 0x7F000001, 0xC1FFFFFF),
+                ),
+                6: ((1,), (1,)),
+            },
+        )
+        self.assertIs(_parse_allowlist_value(raw)[0], index)
+
+    def test_allowlist_contains(self):
+        index, _ = _parse_allowlist_value("10.0.0.0/8, 127.0.0.1, 192.0.0.0/7, ::1")
+        for addr, expected in (
+            ("10.200.0.1", True),
+            ("9.255.255.255", False),
+            ("127.0.0.1", True),
+            ("127.0.0.2", False),
+            ("193.1.2.3", True),
+            ("194.0.0.0", False),
+            ("1.1.1.1", False),
+            ("::1", True),
+            ("::2", False),
+        ):
+            with self.subTest(addr=addr):
+                ip = ipaddress.ip_address(addr)
+                self.assertEqual(webhooks._allowlist_contains(index, ip), expected)
+
+    def test_rate_limit_sweeps_idle_addresses(self):
+        now = time.monotonic()
+        state = {"idle": (0.0, now - 120), "active": (0.0, now)}
+        with patch.dict(webhooks._RATE_LIMIT_STATE, state, clear=True), patch.multiple(
+            webhooks, _RATE_LIMIT_SWEEP_THRESHOLD=2, _rate_limit_next_sweep=0.0
+        ):
+            self.assertIsNone(webhooks._check_rate_limit("new", 1))
+            self.assertEqual(set(webhooks._RATE_LIMIT_STATE), {"active", "new"})
+            self.assertEqual(webhooks._check_rate_limit("new", 1), 60)
+
+            # The next sweep waits a full window, even above the threshold.
+            webhooks._RATE_LIMIT_STATE["idle"] = (0.0, now - 120)
+            webhooks._check_rate_limit("new", 1)
+            self.assertIn("idle", webhooks._RATE_LIMIT_STATE)
+
+    def test_rate_limit_state_is_capped(self):
+        state = {"old": (0.0, time.monotonic()), "recent": (0.0, time.monotonic())}
+        with patch.dict(webhooks._RATE_LIMIT_STATE, state, clear=True), patch.object(
+            webhooks, "_RATE_LIMIT_MAX_ENTRIES", 2
+        ):
+            webhooks._check_rate_limit("old", 1)
+            webhooks._check_rate_limit("new", 1)
+            self.assertEqual(list(webhooks._RATE_LIMIT_STATE), ["old", "new"])
+
+    def test_dumps_json_fallback(self):
+        payload = {"libraries": [{"name": "Séries", "locations": [], "type": None}]}
+        with patch.object(webhooks, "orjson", None):
+            compact = webhooks._dumps_json(payload, False)
+            pretty = webhooks._dumps_json(payload, True)
+        self.assertEqual(
+            compact.decode(),
+            '{"libraries":[{"name":"Séries","locations":[],"type":null}]}',
+        )
+        self.assertEqual(
+            pretty.decode(),
+            '{\n  "libraries": [\n    {\n      "name": "Séries",\n'
+            '      "locations": [],\n      "type": null\n    }\n  ]\n}',
+        )
+
+    @unittest.skipUnless(orjson, "orjson not installed")
+    def test_dumps_json_orjson_matches_fallback(self):
+        payload = {"libraries": [{"name": "Séries", "locations": [], "type": None}]}
+        for pretty in (False, True):
+            with self.subTest(pretty=pretty):
+                with patch.object(webhooks, "orjson", orjson):
+                    fast = webhooks._dumps_json(payload, pretty)
+                with patch.object(webhooks, "orjson", None):
+                    fallback = webhooks._dumps_json(payload, pretty)
+                self.assertEqual(fast, fallback)
+
+    def test_get_payload_decodes_with_either_parser(self):
+        parsers = [("json", None)] + ([("orjson", orjson)] if orjson else [])
+        cases = [
+            (b'{"eventType": "Test"}', {"eventType": "Test"}),
+            (b'["not", "an", "object"]', {}),
+            (b"{not json", {}),
+            (b'{"title": "\xff"}', {}),
+        ]
+        for name, parser in parsers:
+            for raw, expected in cases:
+                with self.subTest(parser=name, raw=raw):
+                    req = SimpleNamespace(is_json=True, get_data=lambda cache: raw)
+                    with patch.object(webhooks, "orjson", parser):
+                        self.assertEqual(dict(webhooks._get_payload(req)), expected)
+
+    def test_get_payload_ignores_non_json_requests(self):
+        req = SimpleNamespace(is_json=False, get_data=None)
+        self.assertIs(webhooks._get_payload(req), webhooks._EMPTY)
+
+    def test_event_logging_skipped_when_info_disabled(self):
+        root = logging.getLogger()
+        with patch.object(root, "isEnabledFor", return_value=False), patch.object(
+            logging, "info"
+        ) as mock_info:
+            webhooks._log_radarr_event({"movie": {"title": "Film"}})
+            webhooks._log_sonarr_event({"series": {"title": "Show"}})
+        mock_info.assert_not_called()
+
+    def test_read_webhook_context_uses_raw_environ(self):
+        req = SimpleNamespace(
+            environ={
+                "HTTP_X_JELLYFIN_URL": "http://jf",
+                "HTTP_X_JELLYFIN_API_KEY": "key",
+                "HTTP_X_JELLYFIN_LIBRARY_IDS": "a, b",
+                "HTTP_X_JELLYFIN_COLLECTION_TYPES": "Movies",
+            }
+        )
+        ctx, error = webhooks._read_webhook_context(req)
+        self.assertIsNone(error)
+        self.assertEqual(
+            ctx, webhooks.WebhookContext("http://jf", "key", ("a", "b"), ("movies",))
+        )
+
+    def test_read_webhook_context_without_target_headers(self):
+        req = SimpleNamespace(
+            environ={
+                "HTTP_X_JELLYFIN_URL": "http://jf",
+                "HTTP_X_JELLYFIN_API_KEY": "key",
+            }
+        )
+        ctx, error = webhooks._read_webhook_context(req)
+        self.assertIsNone(error)
+        self.assertEqual(ctx, webhooks.WebhookContext("http://jf", "key", (), ()))
+
 
 if __name__ == "__main__":
     unittest.main()